@@ -0,0 +1,190 @@
+"""
+Active pricing dataset: atomic activation and cached resolution.
+
+The loader stages a new dataset while it is inactive, then activates it by
+moving a single pointer (dataset_version.active_dataset_id) and bumping the
+generation counter in one short transaction.
+
+Each API worker keeps the active dataset in memory and polls the generation
+at most once per DATASET_REFRESH_SECONDS, which bounds how stale a worker
+can be. When it moves, the new dataset is prepared in a background thread
+while requests keep being served from the current one.
+"""
+import logging
+import os
+import time
+from datetime import datetime
+from threading import Lock, Thread
+from typing import Callable, List, NamedTuple, Optional
+
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import DatasetVersion, PricingDataset
+from snapshot import remove_snapshot
+from storage import drop_dataset_rows
+
+DATASET_REFRESH_SECONDS = float(os.getenv("DATASET_REFRESH_SECONDS", "2"))
+
+logger = logging.getLogger(__name__)
+
+
+class ActiveDataset(NamedTuple):
+    """Detached copy of the active PricingDataset row."""
+    id: int
+    name: str
+    row_count: int
+    uploaded_at: Optional[datetime]
+    age_brackets: Optional[list]
+    age_lookup: Optional[list]
+    storage_table: Optional[str]
+    generation: int = 0  # DatasetVersion.generation it was activated with
+
+
+def activate_dataset(db: Session, dataset_id: int) -> None:
+    """
+    Make a fully loaded dataset the active one and commit.
+    Flips is_active and the version pointer together, so readers see exactly
+    one active dataset before and after.
+    """
+    db.query(PricingDataset).filter(
+        PricingDataset.is_active == True, PricingDataset.id != dataset_id
+    ).update({PricingDataset.is_active: False}, synchronize_session=False)
+    db.query(PricingDataset).filter(
+        PricingDataset.id == dataset_id
+    ).update({PricingDataset.is_active: True}, synchronize_session=False)
+
+    updated = db.query(DatasetVersion).filter(DatasetVersion.id == 1).update({
+        DatasetVersion.generation: DatasetVersion.generation + 1,
+        DatasetVersion.active_dataset_id: dataset_id,
+    }, synchronize_session=False)
+    if not updated:
+        db.add(DatasetVersion(id=1, generation=1, active_dataset_id=dataset_id))
+
+    db.commit()
+
+
+def discard_dataset(db: Session, dataset_id: int) -> None:
+    """Remove a staged dataset that failed to load. Never used on the active one."""
+    db.rollback()
+    dataset = db.query(PricingDataset).filter(
+        PricingDataset.id == dataset_id, PricingDataset.is_active == False
+    ).first()
+    if dataset is None:
+        return
+    drop_dataset_rows(db, dataset_id, dataset.storage_table)
+    remove_snapshot(dataset_id)
+    db.query(PricingDataset).filter(
+        PricingDataset.id == dataset_id
+    ).delete(synchronize_session=False)
+    db.commit()
+
+
+class ActiveDatasetCache:
+    """
+    In-process cache of the active dataset.
+    Listeners run on every change, before the new dataset is published.
+    """
+
+    def __init__(self, refresh_seconds: float = DATASET_REFRESH_SECONDS,
+                 session_factory: Callable[[], Session] = SessionLocal):
+        self.refresh_seconds = refresh_seconds
+        self.dataset: Optional[ActiveDataset] = None
+        self.generation: Optional[int] = None
+        self._session_factory = session_factory
+        self._checked_at = float("-inf")
+        self._listeners: List[Callable[[Session, Optional[ActiveDataset]], None]] = []
+        self._lock = Lock()
+        self._reloading = False
+        # Resolves served without / with a generation check
+        self.hits = 0
+        self.misses = 0
+
+    def subscribe(self, listener: Callable[[Session, Optional[ActiveDataset]], None]) -> None:
+        self._listeners.append(listener)
+
+    @property
+    def fresh(self) -> bool:
+        """True while the cached dataset needs no generation check."""
+        return time.monotonic() - self._checked_at < self.refresh_seconds
+
+    def resolve(self, db: Session) -> Optional[ActiveDataset]:
+        """Active dataset, re-validated against the generation counter when stale."""
+        if self.fresh:
+            self.hits += 1
+            return self.dataset
+
+        self.misses += 1
+        # One thread polls; the rest keep serving the current dataset
+        if not self._lock.acquire(blocking=self.generation is None):
+            return self.dataset
+        try:
+            if not self.fresh:
+                self._poll(db)
+            return self.dataset
+        finally:
+            self._lock.release()
+
+    def invalidate(self) -> None:
+        """Force the next resolve() to check the generation counter."""
+        self._checked_at = float("-inf")
+
+    def _poll(self, db: Session) -> None:
+        try:
+            generation = db.query(DatasetVersion.generation).filter(
+                DatasetVersion.id == 1
+            ).scalar() or 0
+
+            if generation == self.generation or self._reloading:
+                return
+
+            if self.generation is None:
+                # Nothing to serve yet - load in the request
+                self._reload(db)
+            else:
+                self._reloading = True
+                Thread(target=self._reload_in_background, daemon=True).start()
+        finally:
+            # A failed reload is retried on the next poll, not on every request
+            self._checked_at = time.monotonic()
+
+    def _reload_in_background(self) -> None:
+        db = self._session_factory()
+        try:
+            self._reload(db)
+        except Exception:
+            logger.exception("Reloading the active pricing dataset failed")
+        finally:
+            db.close()
+            self._reloading = False
+
+    def _reload(self, db: Session) -> None:
+        version = db.query(DatasetVersion).filter(DatasetVersion.id == 1).first()
+
+        if version and version.active_dataset_id is not None:
+            active = db.get(PricingDataset, version.active_dataset_id)
+        else:
+            # Databases written before the version pointer existed
+            active = db.query(PricingDataset).filter(
+                PricingDataset.is_active == True
+            ).first()
+
+        dataset = ActiveDataset(
+            id=active.id,
+            name=active.name,
+            row_count=active.row_count,
+            uploaded_at=active.uploaded_at,
+            age_brackets=active.age_brackets,
+            age_lookup=active.age_lookup,
+            storage_table=active.storage_table,
+            generation=version.generation if version else 0,
+        ) if active else None
+
+        for listener in self._listeners:
+            listener(db, dataset)
+
+        self.dataset = dataset
+        self.generation = version.generation if version else 0
+
+
+dataset_cache = ActiveDatasetCache()
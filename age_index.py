@@ -0,0 +1,107 @@
+"""
+Age-bracket interval index.
+Sorted, non-overlapping [age_min, age_max] brackets with O(log n) lookup.
+Shared by the quote engine and by loader validation.
+"""
+from bisect import bisect_right
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+Bracket = Tuple[int, int]
+
+# Age bounds accepted by the quote endpoints
+MIN_AGE = 18
+MAX_AGE = 100
+
+
+class AgeBracketError(ValueError):
+    """Brackets in a pricing group overlap or leave gaps."""
+
+
+class AgeIntervalIndex:
+    """
+    Sorted age brackets for one pricing group.
+    Identical brackets (e.g. one per provider) collapse into a single entry;
+    distinct brackets that overlap are rejected.
+    """
+
+    def __init__(self, brackets: Iterable[Bracket]):
+        self.brackets: List[Bracket] = sorted(set((int(lo), int(hi)) for lo, hi in brackets))
+
+        for lo, hi in self.brackets:
+            if lo > hi:
+                raise AgeBracketError(f"Invalid age bracket {lo}-{hi}")
+
+        for (lo, hi), (next_lo, next_hi) in zip(self.brackets, self.brackets[1:]):
+            if next_lo <= hi:
+                raise AgeBracketError(
+                    f"Age brackets {lo}-{hi} and {next_lo}-{next_hi} overlap"
+                )
+
+        self._starts = [lo for lo, _ in self.brackets]
+        self._ends = [hi for _, hi in self.brackets]
+
+    def __len__(self) -> int:
+        return len(self.brackets)
+
+    def find(self, age: int) -> Optional[int]:
+        """Ordinal of the bracket containing age, or None."""
+        i = bisect_right(self._starts, age) - 1
+        if i < 0 or age > self._ends[i]:
+            return None
+        return i
+
+    def gaps(self) -> List[Bracket]:
+        """Age ranges between the first and last bracket that no bracket covers."""
+        return [
+            (hi + 1, next_lo - 1)
+            for (_, hi), (next_lo, _) in zip(self.brackets, self.brackets[1:])
+            if next_lo > hi + 1
+        ]
+
+
+def validate_groups(groups: Dict[Hashable, Iterable[Bracket]]) -> Dict[Hashable, AgeIntervalIndex]:
+    """
+    Build an index per pricing group, raising on overlaps or gaps.
+    Returns the indexes so callers can reuse them.
+    """
+    indexes = {}
+    for key, brackets in groups.items():
+        try:
+            index = AgeIntervalIndex(brackets)
+        except AgeBracketError as e:
+            raise AgeBracketError(f"{e} in group {key}") from None
+
+        gaps = index.gaps()
+        if gaps:
+            missing = ", ".join(f"{lo}-{hi}" for lo, hi in gaps)
+            raise AgeBracketError(f"Ages {missing} not covered in group {key}")
+
+        indexes[key] = index
+    return indexes
+
+
+def segment_brackets(brackets: Iterable[Bracket]) -> AgeIntervalIndex:
+    """
+    The coarsest non-overlapping brackets every given bracket is a union of.
+    Pricing groups may each use their own layout - 18-30/31-100 and
+    18-40/41-100 give 18-30/31-40/41-100 - and one ordinal per segment
+    (and one dense age table) then applies to all of them.
+    """
+    brackets = set((int(lo), int(hi)) for lo, hi in brackets)
+    cuts = sorted({lo for lo, _ in brackets} | {hi + 1 for _, hi in brackets})
+    return AgeIntervalIndex(
+        (lo, next_lo - 1) for lo, next_lo in zip(cuts, cuts[1:])
+        # Ages between the groups' ranges that no bracket covers stay out
+        if any(b_lo <= lo and next_lo - 1 <= b_hi for b_lo, b_hi in brackets)
+    )
+
+
+def dense_lookup(index: AgeIntervalIndex, min_age: int = MIN_AGE, max_age: int = MAX_AGE) -> List[int]:
+    """
+    Bracket ordinal for every integer age in [min_age, max_age].
+    Ages no bracket covers map to -1. Position 0 is min_age.
+    """
+    return [
+        ordinal if ordinal is not None else -1
+        for ordinal in (index.find(age) for age in range(min_age, max_age + 1))
+    ]
@@ -0,0 +1,91 @@
+"""
+Benchmark: requests/sec for DB_MODE=sync vs DB_MODE=async.
+
+Starts the API under uvicorn once per mode and drives POST /api/prices/quote
+from --clients concurrent connections. DATASET_REFRESH_SECONDS defaults to
+0 here so every request performs the generation check against the
+database, which is the part the two modes handle differently.
+
+Requires httpx (pip install httpx).
+Usage: python -m benchmarks.bench_db_modes [--clients 200] [--duration 10]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+QUOTE = {"age": 30, "zip_code": "80012", "insurance_model": "basic", "deductible": 300}
+
+
+async def drive(base_url: str, clients: int, duration: float) -> list:
+    latencies = []
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        async def worker():
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                response = await client.post("/api/prices/quote", json=QUOTE)
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(worker() for _ in range(clients)))
+    return latencies
+
+
+def wait_ready(base_url: str, timeout: float = 30) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"{base_url}/api/health").status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("API did not start")
+
+
+def run_mode(mode: str, args) -> None:
+    env = dict(os.environ, DB_MODE=mode, DATASET_REFRESH_SECONDS=str(args.refresh_seconds))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"],
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_ready(base_url)
+        asyncio.run(drive(base_url, args.clients, 1))  # warm up
+        latencies = asyncio.run(drive(base_url, args.clients, args.duration))
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(
+        f"{mode:>5}: {len(latencies) / args.duration:8,.0f} req/s  "
+        f"p50 {statistics.median(latencies) * 1000:6.1f} ms  p99 {p99 * 1000:6.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--refresh-seconds", type=float, default=0)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    print(f"{args.clients} concurrent clients, {args.duration:.0f}s per mode")
+    for mode in ("sync", "async"):
+        run_mode(mode, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark: loader column normalization, per-row vs vectorized.
+
+Builds a synthetic sheet in the raw Excel conventions (title-case headers,
+5-digit ZIPs, yes/no accident flags, upper-case model names) and times the
+old apply()/iterrows() coercion against ingest.normalize_frame.
+
+Usage: python -m benchmarks.bench_normalize [--rows 500000]
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from ingest import normalize_frame
+
+
+def synthetic_sheet(rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    brackets = np.array([(18, 25), (26, 35), (36, 45), (46, 55), (56, 65), (66, 100)])
+    bracket = brackets[rng.integers(0, len(brackets), rows)]
+    providers = np.array([("Helsana", "HEL"), ("CSS", "CSS"), ("Swica", "SWI"), ("Sanitas", "SAN")])
+    provider = providers[rng.integers(0, len(providers), rows)]
+    return pd.DataFrame({
+        "Age Min": bracket[:, 0],
+        "Age Max": bracket[:, 1],
+        "ZIP Code": rng.integers(80000, 86999, rows).astype(str),
+        "Insurance Model": rng.choice(["Basic", "STANDARD", "premium"], rows),
+        "Deductible": rng.choice([300, 500, 1000, 1500, 2000, 2500], rows),
+        "Accident Coverage": rng.choice(["Yes", "no", "TRUE", "0"], rows),
+        "Monthly Premium": rng.uniform(150, 600, rows).round(2),
+        "Provider Name": provider[:, 0],
+        "Provider Code": provider[:, 1],
+    })
+
+
+def normalize_per_row(df: pd.DataFrame) -> list:
+    """The loader's original approach: apply() + iterrows() with per-value casts."""
+    df = df.copy()
+    df.columns = df.columns.str.lower().str.strip().str.replace(' ', '_')
+    df['zip_prefix'] = df['zip_code'].astype(str).str[:3]
+    df['annual_premium'] = df['monthly_premium'] * 12
+    df['accident_coverage'] = df['accident_coverage'].apply(
+        lambda x: str(x).lower() in ('yes', 'true', '1', 'y')
+    )
+    return [
+        (
+            int(row['age_min']),
+            int(row['age_max']),
+            str(row['zip_prefix']),
+            str(row['insurance_model']).lower(),
+            int(row['deductible']),
+            bool(row['accident_coverage']),
+            float(row['monthly_premium']),
+            float(row['annual_premium']),
+            str(row['provider_name']),
+            str(row['provider_code']),
+        )
+        for _, row in df.iterrows()
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=500_000)
+    args = parser.parse_args()
+
+    df = synthetic_sheet(args.rows)
+
+    start = time.perf_counter()
+    normalize_per_row(df)
+    per_row = time.perf_counter() - start
+
+    start = time.perf_counter()
+    normalize_frame(df)
+    vectorized = time.perf_counter() - start
+
+    print(f"rows:       {args.rows:,}")
+    print(f"per-row:    {per_row:8.3f}s  ({args.rows / per_row:,.0f} rows/sec)")
+    print(f"vectorized: {vectorized:8.3f}s  ({args.rows / vectorized:,.0f} rows/sec)")
+    print(f"speedup:    {per_row / vectorized:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
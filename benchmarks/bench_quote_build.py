@@ -0,0 +1,135 @@
+"""
+Benchmark: per-quote overhead of building compare response bodies.
+
+Loads a 5-provider x 6-deductible x 3-model sample into an in-memory SQLite
+database and times one compare (a single model, i.e. 30 quotes) four ways:
+- orm:     full InsurancePrice entities -> QuoteResponse -> pydantic JSON
+- columns: response columns as tuples   -> QuoteResponse -> pydantic JSON
+- models:  QuoteIndex lookup            -> QuoteResponse -> pydantic JSON
+- index:   QuoteIndex lookup            -> pre-encoded rows (what the API does)
+
+Usage: python -m benchmarks.bench_quote_build [--repeat 2000]
+"""
+import argparse
+import tempfile
+import time
+
+from typing import List
+
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from ingest import bulk_insert_prices
+from loader import SAMPLE_AGE_BRACKETS, sample_price_chunks, sample_providers
+from active_dataset import ActiveDataset
+from main import QuoteResponse, compare_prefix
+from models import Base, InsurancePrice, PricingDataset
+from quote_engine import QuoteEngine
+
+RESPONSE_COLUMNS = (
+    InsurancePrice.provider_name,
+    InsurancePrice.provider_code,
+    InsurancePrice.monthly_premium,
+    InsurancePrice.annual_premium,
+    InsurancePrice.deductible,
+    InsurancePrice.insurance_model,
+    InsurancePrice.accident_coverage,
+)
+
+ZIP_PREFIX, AGE, MODEL, ACCIDENT = "800", 30, "basic", False
+
+QUOTE_LIST = TypeAdapter(List[QuoteResponse])
+
+
+def build_db() -> Session:
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    db = Session(engine)
+    db.add(PricingDataset(id=1, name="bench", is_active=True, row_count=0))
+    for columns in sample_price_chunks(sample_providers(5), SAMPLE_AGE_BRACKETS, [ZIP_PREFIX]):
+        bulk_insert_prices(db, 1, columns)
+    db.commit()
+    return db
+
+
+def group_filter():
+    return (
+        InsurancePrice.dataset_id == 1,
+        InsurancePrice.zip_prefix == ZIP_PREFIX,
+        InsurancePrice.insurance_model == MODEL,
+        InsurancePrice.accident_coverage == ACCIDENT,
+        InsurancePrice.age_min <= AGE,
+        InsurancePrice.age_max >= AGE,
+    )
+
+
+def encode_models(prices) -> bytes:
+    """Per-request QuoteResponse construction and serialization."""
+    return QUOTE_LIST.dump_json([
+        QuoteResponse(
+            provider_name=p.provider_name,
+            provider_code=p.provider_code,
+            monthly_premium=round(p.monthly_premium, 2),
+            annual_premium=round(p.annual_premium, 2),
+            deductible=p.deductible,
+            insurance_model=p.insurance_model,
+            accident_coverage=p.accident_coverage,
+        )
+        for p in prices
+    ])
+
+
+def compare_orm(db: Session) -> bytes:
+    prices = db.query(InsurancePrice).filter(*group_filter()).order_by(InsurancePrice.monthly_premium).all()
+    body = encode_models(prices)
+    db.expunge_all()  # a request-scoped session starts with an empty identity map
+    return body
+
+
+def compare_columns(db: Session) -> bytes:
+    prices = db.execute(
+        select(*RESPONSE_COLUMNS).where(*group_filter()).order_by(InsurancePrice.monthly_premium)
+    ).all()
+    return encode_models(prices)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    db = build_db()
+    row = db.get(PricingDataset, 1)
+    dataset = ActiveDataset(row.id, row.name, row.row_count, row.uploaded_at,
+                            row.age_brackets, row.age_lookup, row.storage_table)
+    engine = QuoteEngine(snapshot_dir=tempfile.mkdtemp())
+    engine.load(db, dataset)
+
+    def compare_models(db: Session) -> bytes:
+        return encode_models(engine.index.compare(ZIP_PREFIX, ACCIDENT, AGE, insurance_model=MODEL))
+
+    def compare_index(db: Session) -> bytes:
+        return compare_prefix(engine.index.compare(ZIP_PREFIX, ACCIDENT, AGE, insurance_model=MODEL))
+
+    quotes = len(engine.index.compare(ZIP_PREFIX, ACCIDENT, AGE, insurance_model=MODEL))
+    print(f"quotes per compare: {quotes}")
+
+    results = {}
+    for name, fn in (("orm", compare_orm), ("columns", compare_columns),
+                     ("models", compare_models), ("index", compare_index)):
+        fn(db)  # warm up
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            fn(db)
+        per_compare = (time.perf_counter() - start) / args.repeat
+        results[name] = per_compare
+        print(f"{name:8} {per_compare * 1e6:9.1f} us/compare  {per_compare / quotes * 1e6:7.2f} us/quote")
+
+    print(f"columns vs orm: {results['orm'] / results['columns']:.1f}x, "
+          f"index vs orm: {results['orm'] / results['index']:.1f}x, "
+          f"index vs models: {results['models'] / results['index']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Benchmark: dataset snapshot file vs reading price rows from the database.
+
+Generates a sample dataset into a temporary SQLite file (shared
+insurance_prices table, so the ORM can map it), writes its snapshot, and
+compares:
+- size:  the rows' table and index pages vs the snapshot file
+- read:  all rows as ORM entities, as column tuples (snapshot_query), and
+         mapping the snapshot (plus touching every page of it)
+- index: QuoteEngine.load when the snapshot must first be built from the
+         database (a dataset the loader wrote no snapshot for) vs when it
+         only maps the existing file (every other worker and reload)
+
+Usage: python -m benchmarks.bench_snapshot [--providers 10] [--zip-prefixes 100] [--repeat 3]
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from active_dataset import ActiveDataset
+from age_index import AgeIntervalIndex, dense_lookup
+from ingest import bulk_insert_prices
+from loader import SAMPLE_AGE_BRACKETS, sample_price_chunks, sample_providers, sample_zip_prefixes
+from models import Base, InsurancePrice, PricingDataset
+from quote_engine import QuoteEngine, write_dataset_snapshot
+from snapshot import SOURCE_COLUMNS, open_snapshot, remove_snapshot, snapshot_path, snapshot_query
+
+# Source columns as stored (provider name and code share one coded column)
+SNAPSHOT_COLUMNS = [name for name in SOURCE_COLUMNS if not name.startswith("provider_")] + ["provider"]
+
+
+def build_db(path: Path, providers: int, zip_prefixes: int) -> Session:
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    db = Session(engine)
+    ages = AgeIntervalIndex(SAMPLE_AGE_BRACKETS)
+    dataset = PricingDataset(id=1, name="bench", is_active=True, row_count=0,
+                             age_brackets=[list(b) for b in ages.brackets], age_lookup=dense_lookup(ages))
+    db.add(dataset)
+    for columns in sample_price_chunks(sample_providers(providers), ages.brackets,
+                                       sample_zip_prefixes(zip_prefixes)):
+        dataset.row_count += bulk_insert_prices(db, 1, columns)
+    db.commit()
+    return db
+
+
+def table_bytes(db: Session) -> int:
+    """Pages of insurance_prices and its indexes (SQLite's dbstat)."""
+    return db.connection().exec_driver_sql(
+        "SELECT SUM(pgsize) FROM dbstat WHERE name IN "
+        "(SELECT name FROM sqlite_master WHERE tbl_name = 'insurance_prices')"
+    ).scalar()
+
+
+def timed(fn, repeat: int) -> float:
+    """Best of repeat runs, in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--providers", type=int, default=10)
+    parser.add_argument("--zip-prefixes", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = build_db(Path(tmp) / "bench.db", args.providers, args.zip_prefixes)
+        row = db.get(PricingDataset, 1)
+        snapshot_file = snapshot_path(1, tmp)
+        start = time.perf_counter()
+        snapshot_size = write_dataset_snapshot(db, row, tmp)
+        write_time = time.perf_counter() - start
+        dataset = ActiveDataset(row.id, row.name, row.row_count, row.uploaded_at,
+                                row.age_brackets, row.age_lookup, row.storage_table)
+        db_size = table_bytes(db)
+
+        print(f"rows: {dataset.row_count:,}")
+        print(f"size  table+indexes {db_size / 1e6:8.1f} MB  ({db_size / dataset.row_count:5.1f} B/row)")
+        print(f"      snapshot      {snapshot_size / 1e6:8.1f} MB  ({snapshot_size / dataset.row_count:5.1f} B/row)"
+              f"  written in {write_time * 1e3:.0f} ms")
+        arrays = open_snapshot(snapshot_file).columns
+        encoded = arrays["quote_json"].nbytes + arrays["quote_json_offsets"].nbytes
+        columns = sum(arrays[name].nbytes for name in SNAPSHOT_COLUMNS)
+        print(f"        columns     {columns / 1e6:8.1f} MB  ({columns / dataset.row_count:5.1f} B/row)")
+        print(f"        row JSON    {encoded / 1e6:8.1f} MB  ({encoded / dataset.row_count:5.1f} B/row)")
+        print(f"        index       {(snapshot_size - columns - encoded) / 1e6:8.1f} MB")
+
+        def read_orm():
+            db.query(InsurancePrice).filter(InsurancePrice.dataset_id == 1).order_by(InsurancePrice.id).all()
+            db.expunge_all()
+
+        def read_columns():
+            db.execute(snapshot_query(1, InsurancePrice.__table__)).all()
+
+        def read_snapshot():
+            snapshot = open_snapshot(snapshot_file)
+            # Fault every page in, so the time covers more than the mmap call
+            for column in snapshot.columns.values():
+                column.sum()
+
+        results = {}
+        for name, fn in (("orm", read_orm), ("columns", read_columns), ("snapshot", read_snapshot)):
+            results[name] = timed(fn, args.repeat)
+            print(f"read  {name:13} {results[name] * 1e3:9.1f} ms")
+        print(f"      mmap only     {timed(lambda: open_snapshot(snapshot_file), args.repeat) * 1e3:9.2f} ms")
+
+        engine = QuoteEngine(snapshot_dir=tmp)
+
+        def load_building():
+            remove_snapshot(1, tmp)
+            engine.load(db, dataset)
+
+        database_load = timed(load_building, args.repeat)
+        snapshot_load = timed(lambda: engine.load(db, dataset), args.repeat)
+        assert engine.index.row_count == dataset.row_count
+        print(f"index building      {database_load * 1e3:9.1f} ms")
+        print(f"index mapping       {snapshot_load * 1e3:9.1f} ms")
+        print(f"snapshot read vs orm: {results['orm'] / results['snapshot']:.0f}x, "
+              f"vs columns: {results['columns'] / results['snapshot']:.0f}x; "
+              f"index load: {database_load / snapshot_load:.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+"""
+JSON encoding for response bodies.
+Uses orjson when installed, otherwise pydantic-core's to_json, which ships
+with pydantic. Both return compact UTF-8 bytes.
+"""
+try:
+    import orjson
+
+    def dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+
+except ImportError:
+    from pydantic_core import to_json
+
+    def dumps(obj) -> bytes:
+        return to_json(obj)
+
+
+def join_array(items) -> bytes:
+    """JSON array from already encoded elements."""
+    return b"[" + b",".join(items) + b"]"
@@ -0,0 +1,178 @@
+"""
+Index strategy for price tables.
+
+Quote and compare lookups are answered from the quote index over the
+dataset snapshot, so the only queries that still reach price rows are
+per-dataset scans: writing that snapshot, computing dropdown options, and
+the loader's dataset-wide UPDATE. The indexes declared on InsurancePrice (and copied
+to per-dataset tables, see storage.py) match those shapes; anything more
+is pure write cost on every load.
+
+    python indexes.py migrate   # bring an existing database's columns and indexes up to date
+    python indexes.py check     # EXPLAIN each query shape, exit 1 if one misses its index
+"""
+import json
+import sys
+from typing import List, NamedTuple, Optional
+
+from sqlalchemy import Select, inspect, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+
+from models import Base, InsurancePrice, PricingDataset
+from options import option_queries
+from snapshot import snapshot_query
+from storage import options_index_name, prices_table
+
+# Indexes from earlier schemas that served per-request SQL lookups
+OBSOLETE_INDEXES = ['idx_pricing_lookup', 'idx_age_range']
+
+
+class QueryShape(NamedTuple):
+    name: str
+    statement: Select
+    index: Optional[str]  # Index the plan must use (None: any plan)
+    sorted: bool = False  # ORDER BY must not need a sort step
+
+
+def query_shapes(dataset_id: int, storage_table: Optional[str]) -> List[QueryShape]:
+    """Query shapes against a dataset's price table."""
+    table = prices_table(storage_table)
+    options = option_queries(dataset_id, table)
+    if storage_table is None:
+        # Shared table: the dataset's rows must be found, and returned in order, by index
+        load_index, options_index = "idx_prices_dataset", "idx_prices_options"
+    else:
+        # Own table: a plain scan already returns them in rowid order
+        load_index, options_index = None, options_index_name(storage_table)
+    return [
+        QueryShape("snapshot_load", snapshot_query(dataset_id, table), load_index, sorted=True),
+        QueryShape("options_models", options["models"], options_index),
+        QueryShape("options_deductibles", options["deductibles"], options_index),
+        QueryShape("options_providers", options["providers"], options_index),
+    ]
+
+
+def migrate_columns(engine: Engine) -> List[str]:
+    """
+    Add columns declared on the models but missing from existing tables
+    (create_all only creates whole tables). Every column added since the
+    first schema is nullable, and NULL is what the code reads as "written
+    before this existed". Returns the statements that changed something.
+
+    Every API worker runs this at startup, so each column is added in its
+    own transaction, and one another worker added in the meantime is skipped.
+    """
+    changes = []
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            statement = (f"ALTER TABLE {table.name} ADD COLUMN {column.name} "
+                         f"{column.type.compile(dialect=engine.dialect)}")
+            try:
+                with engine.begin() as conn:
+                    conn.execute(text(statement))
+            except DBAPIError:
+                # Fresh inspector: the first one caches the columns it read
+                if column.name not in {c["name"] for c in inspect(engine).get_columns(table.name)}:
+                    raise
+                continue
+            changes.append(statement)
+    return changes
+
+
+def migrate_indexes(engine: Engine) -> List[str]:
+    """
+    Drop obsolete indexes and create missing ones on an existing database
+    (create_all never touches indexes of tables that already exist).
+    Returns the statements that changed something.
+    """
+    changes = []
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        shared = InsurancePrice.__table__
+        existing = {ix["name"] for ix in inspector.get_indexes(shared.name)}
+        for name in OBSOLETE_INDEXES:
+            if name in existing:
+                conn.execute(text(f"DROP INDEX {name}"))
+                changes.append(f"DROP INDEX {name}")
+
+        tables = [shared] + [
+            prices_table(name) for name in conn.execute(
+                select(PricingDataset.storage_table).where(PricingDataset.storage_table.isnot(None))
+            ).scalars()
+            if inspector.has_table(name)
+        ]
+        for table in tables:
+            existing = {ix["name"] for ix in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(conn)
+                    changes.append(f"CREATE INDEX {index.name}")
+    return changes
+
+
+def explain(engine: Engine, statement: Select) -> str:
+    """Query plan of a statement as text."""
+    sql = str(statement.compile(engine, compile_kwargs={"literal_binds": True}))
+    with engine.connect() as conn:
+        if engine.dialect.name == "sqlite":
+            rows = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}")).all()
+            return "\n".join(row[-1] for row in rows)
+
+        # Tiny or freshly loaded tables make a seq scan look cheapest; what
+        # matters here is whether the index can serve the query at all
+        with conn.begin():
+            conn.execute(text("SET LOCAL enable_seqscan = off"))
+            plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+        return json.dumps(plan if not isinstance(plan, str) else json.loads(plan), indent=1)
+
+
+def check_plan(engine: Engine, shape: QueryShape) -> List[str]:
+    """Problems with a query shape's plan (empty when it uses its index)."""
+    plan = explain(engine, shape.statement)
+    problems = []
+    if shape.index is not None and shape.index not in plan:
+        problems.append(f"does not use {shape.index}")
+    if shape.sorted and ("TEMP B-TREE FOR ORDER BY" in plan or '"Node Type": "Sort"' in plan):
+        problems.append("sorts instead of reading in index order")
+    return problems
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from database import SessionLocal, engine, init_db
+
+    parser = argparse.ArgumentParser(description="Manage price table indexes.")
+    parser.add_argument("command", choices=["migrate", "check"])
+    parser.add_argument("-v", "--verbose", action="store_true", help="print each query plan")
+    args = parser.parse_args()
+
+    init_db()
+    if args.command == "migrate":
+        for change in migrate_columns(engine) + migrate_indexes(engine) or ["schema already up to date"]:
+            print(change)
+    else:
+        db = SessionLocal()
+        try:
+            active = db.query(PricingDataset).filter(PricingDataset.is_active == True).first()
+        finally:
+            db.close()
+        if active is None:
+            sys.exit("No active dataset to check")
+        print(f"dataset {active.id} in {active.storage_table or InsurancePrice.__tablename__}")
+
+        failed = False
+        for shape in query_shapes(active.id, active.storage_table):
+            problems = check_plan(engine, shape)
+            failed = failed or bool(problems)
+            print(f"{shape.name:22} {'FAIL: ' + '; '.join(problems) if problems else 'ok'} ({shape.index or 'table scan'})")
+            if args.verbose:
+                print("    " + explain(engine, shape.statement).replace("\n", "\n    "))
+        sys.exit(1 if failed else 0)
@@ -0,0 +1,214 @@
+"""
+Bulk ingestion helpers for loader.py.
+Price sheets are read in row chunks, normalized, and written column-wise
+with Core insert() executemany (or COPY on Postgres) instead of one ORM
+object per row, so memory stays flat regardless of sheet size.
+"""
+import csv
+import io
+from itertools import repeat
+from pathlib import Path
+from typing import Dict, Iterator
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import Table, insert
+from sqlalchemy.orm import Session
+
+from models import InsurancePrice
+
+# Normalized price columns, keyed by insurance_prices column name
+PriceColumns = Dict[str, np.ndarray]
+
+# accident_coverage values that mean "covered"
+TRUTHY = ['yes', 'true', '1', 'y']
+
+# insurance_prices columns written by the loader, in table order
+PRICE_COLUMNS = [
+    'dataset_id',
+    'age_min',
+    'age_max',
+    'age_bracket',
+    'zip_prefix',
+    'insurance_model',
+    'deductible',
+    'accident_coverage',
+    'monthly_premium',
+    'annual_premium',
+    'provider_name',
+    'provider_code',
+]
+
+# Rows per executemany/COPY batch - bounds parameter list memory
+BATCH_SIZE = 50_000
+
+# Rows per chunk read from the source sheet
+CHUNK_ROWS = 100_000
+
+
+def normalize_column_name(name) -> str:
+    return str(name).lower().strip().replace(' ', '_')
+
+
+def iter_frames(file_path: str, chunk_rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """
+    Yield the first sheet of an .xlsx/.csv/.parquet file as DataFrames of at
+    most chunk_rows rows. Other formats (e.g. legacy .xls) are read whole.
+    """
+    suffix = Path(file_path).suffix.lower()
+    if suffix in ('.xlsx', '.xlsm'):
+        yield from _iter_xlsx(file_path, chunk_rows)
+    elif suffix in ('.csv', '.txt'):
+        # Keep ZIP columns as text so leading zeros survive
+        header = pd.read_csv(file_path, nrows=0).columns
+        zip_columns = {c: str for c in header if normalize_column_name(c) in ('zip_code', 'zip_prefix')}
+        yield from pd.read_csv(file_path, chunksize=chunk_rows, dtype=zip_columns)
+    elif suffix == '.parquet':
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Reading Parquet files requires pyarrow (pip install pyarrow)") from None
+        for batch in pq.ParquetFile(file_path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    else:
+        df = pd.read_excel(file_path)
+        for start in range(0, len(df), chunk_rows):
+            yield df.iloc[start:start + chunk_rows]
+
+
+def _iter_xlsx(file_path: str, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """openpyxl read-only mode streams rows without building the whole sheet."""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+
+        chunk = []
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            chunk.append(row)
+            if len(chunk) >= chunk_rows:
+                yield pd.DataFrame(chunk, columns=header)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=header)
+    finally:
+        workbook.close()
+
+
+def normalize_frame(df: pd.DataFrame) -> PriceColumns:
+    """
+    Apply the sheet conventions to one chunk, column-wise:
+    - column names lowercased, spaces to underscores
+    - 'age' -> age_min/age_max, zip_code -> zip_prefix
+    - insurance_model lowercased
+    - annual_premium defaults to 12 x monthly
+    - accident_coverage yes/no/true/false/1 -> bool
+
+    Returns typed NumPy arrays keyed by insurance_prices column name.
+    """
+    df = df.rename(columns=normalize_column_name)
+
+    if 'age_min' in df.columns:
+        age_min, age_max = df['age_min'], df['age_max']
+    else:
+        age_min = age_max = df['age']
+
+    if 'zip_prefix' in df.columns:
+        zip_prefix = df['zip_prefix'].astype(str)
+    else:
+        zip_prefix = df['zip_code'].astype(str).str[:3]
+
+    monthly_premium = df['monthly_premium'].to_numpy(dtype=np.float64)
+    if 'annual_premium' in df.columns:
+        annual_premium = df['annual_premium'].to_numpy(dtype=np.float64)
+    else:
+        annual_premium = monthly_premium * 12
+
+    if 'accident_coverage' not in df.columns:
+        accident_coverage = np.zeros(len(df), dtype=bool)
+    elif pd.api.types.is_bool_dtype(df['accident_coverage']):
+        accident_coverage = df['accident_coverage'].to_numpy(dtype=bool)
+    else:
+        accident_coverage = (
+            df['accident_coverage'].astype(str).str.lower().isin(TRUTHY).to_numpy(dtype=bool)
+        )
+
+    return {
+        'age_min': age_min.to_numpy(dtype=np.int64),
+        'age_max': age_max.to_numpy(dtype=np.int64),
+        'zip_prefix': zip_prefix.to_numpy(dtype=object),
+        'insurance_model': df['insurance_model'].astype(str).str.lower().to_numpy(dtype=object),
+        'deductible': df['deductible'].to_numpy(dtype=np.int64),
+        'accident_coverage': accident_coverage,
+        'monthly_premium': monthly_premium,
+        'annual_premium': annual_premium,
+        'provider_name': df['provider_name'].astype(str).to_numpy(dtype=object),
+        'provider_code': df['provider_code'].astype(str).to_numpy(dtype=object),
+    }
+
+
+def bulk_insert_prices(db: Session, dataset_id: int, columns: PriceColumns,
+                       table: Table = InsurancePrice.__table__) -> int:
+    """
+    Insert price rows for a dataset, given as equal-length columns keyed by
+    PRICE_COLUMNS (dataset_id is filled in; age_bracket may be omitted),
+    into table (the dataset's storage table).
+    Runs inside the session's transaction; the caller commits.
+    Returns number of rows inserted.
+    """
+    total = len(columns['monthly_premium'])
+    if not total:
+        return 0
+
+    dialect = db.get_bind().dialect
+    if dialect.name == "postgresql" and dialect.driver in ("psycopg2", "psycopg"):
+        insert_batch = _copy_batch
+    else:
+        insert_batch = _executemany_batch
+
+    for start in range(0, total, BATCH_SIZE):
+        stop = start + BATCH_SIZE
+        # tolist() turns NumPy scalars into Python values the DBAPI accepts
+        batch = [
+            _as_list(columns[name][start:stop]) if name in columns else repeat(None)
+            for name in PRICE_COLUMNS[1:]
+        ]
+        insert_batch(db, table, zip(repeat(dataset_id), *batch))
+
+    return total
+
+
+def _as_list(column) -> list:
+    return column.tolist() if hasattr(column, 'tolist') else list(column)
+
+
+def _executemany_batch(db: Session, table: Table, rows) -> None:
+    db.execute(
+        insert(table),
+        [dict(zip(PRICE_COLUMNS, row)) for row in rows],
+    )
+
+
+def _copy_batch(db: Session, table: Table, rows) -> None:
+    """Postgres COPY FROM STDIN on the session's own connection."""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+
+    copy_sql = f"COPY {table.name} ({', '.join(PRICE_COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+
+    cursor = db.connection().connection.cursor()
+    try:
+        if hasattr(cursor, "copy_expert"):  # psycopg2
+            cursor.copy_expert(copy_sql, buffer)
+        else:  # psycopg 3
+            with cursor.copy(copy_sql) as copy:
+                copy.write(buffer.getvalue())
+    finally:
+        cursor.close()
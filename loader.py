@@ -1,17 +1,60 @@
 """
 Excel-to-Database loader for pricing data.
-Reads Excel files and populates the pricing tables.
+Reads Excel (or CSV/Parquet) files and populates the pricing tables.
 """
+import time
+from collections import defaultdict
+from typing import Dict, Iterator, Set
+
+import numpy as np
 import pandas as pd
+from sqlalchemy import Table, case, update
 from sqlalchemy.orm import Session
 from database import SessionLocal, init_db
-from models import PricingDataset, InsurancePrice, Provider
+from ingest import CHUNK_ROWS, PriceColumns, bulk_insert_prices, iter_frames, normalize_frame
+from models import PricingDataset
+from storage import create_partition, dataset_filter, prices_table
+from options import build_options
+from quote_engine import write_dataset_snapshot
+from active_dataset import activate_dataset, discard_dataset
+from retention import RETAIN_DATASETS, run_retention
+from age_index import MAX_AGE, MIN_AGE, AgeIntervalIndex, dense_lookup, segment_brackets, validate_groups
 from datetime import datetime
 
+# Rows sharing these columns form one pricing group with its own age brackets
+GROUP_COLUMNS = ['zip_prefix', 'insurance_model', 'deductible', 'accident_coverage']
+
+
+def collect_age_brackets(columns: PriceColumns, groups: Dict[tuple, Set[tuple]]) -> None:
+    """Add a normalized chunk's distinct age brackets to groups, per pricing group."""
+    brackets = pd.DataFrame(
+        {name: columns[name] for name in GROUP_COLUMNS + ['age_min', 'age_max']}
+    ).drop_duplicates()
+    for *key, age_min, age_max in brackets.itertuples(index=False):
+        groups[tuple(key)].add((int(age_min), int(age_max)))
+
+
+def assign_age_brackets(db: Session, table: Table, dataset_id: int, ages: AgeIntervalIndex) -> None:
+    """
+    Write age segment ordinals (see segment_brackets) to a dataset's rows
+    in a single UPDATE pass: the segment each row's bracket starts at.
+    """
+    if not ages.brackets:
+        return  # no rows; an empty CASE is not valid SQL
+    db.execute(
+        update(table).where(*dataset_filter(table, dataset_id)).values(
+            age_bracket=case(
+                *[(table.c.age_min == lo, ordinal) for ordinal, (lo, _) in enumerate(ages.brackets)]
+            )
+        )
+    )
+
 
-def load_excel_pricing(file_path: str, dataset_name: str = None) -> int:
+def load_excel_pricing(file_path: str, dataset_name: str = None, chunk_rows: int = CHUNK_ROWS) -> int:
     """
-    Load pricing data from Excel file into database.
+    Load pricing data from an Excel (or CSV/Parquet) file into database.
+    The sheet is streamed in chunks of chunk_rows, so memory use does not
+    grow with sheet size.
 
     Expected Excel columns:
     - age_min, age_max (or just 'age' for single value)
@@ -27,196 +70,276 @@ def load_excel_pricing(file_path: str, dataset_name: str = None) -> int:
     Returns: number of rows loaded
     """
     db = SessionLocal()
+    dataset_id = None
 
     try:
-        # Read Excel
-        df = pd.read_excel(file_path)
-        print(f"Read {len(df)} rows from {file_path}")
-
-        # Normalize column names
-        df.columns = df.columns.str.lower().str.strip().str.replace(' ', '_')
-
-        # Handle age columns
-        if 'age' in df.columns and 'age_min' not in df.columns:
-            df['age_min'] = df['age']
-            df['age_max'] = df['age']
-
-        # Handle ZIP
-        if 'zip_code' in df.columns and 'zip_prefix' not in df.columns:
-            df['zip_prefix'] = df['zip_code'].astype(str).str[:3]
-
-        # Handle annual premium
-        if 'annual_premium' not in df.columns:
-            df['annual_premium'] = df['monthly_premium'] * 12
-
-        # Handle accident coverage
-        if 'accident_coverage' in df.columns:
-            df['accident_coverage'] = df['accident_coverage'].apply(
-                lambda x: str(x).lower() in ('yes', 'true', '1', 'y')
-            )
-        else:
-            df['accident_coverage'] = False
-
-        # Deactivate old datasets
-        db.query(PricingDataset).update({PricingDataset.is_active: False})
-
-        # Create new dataset
+        # Stage into an inactive dataset; API workers keep serving the current one
         dataset = PricingDataset(
             name=dataset_name or f"Import {datetime.now().strftime('%Y-%m-%d %H:%M')}",
-            is_active=True,
-            row_count=len(df),
+            is_active=False,
+            row_count=0,
         )
         db.add(dataset)
-        db.flush()  # Get the ID
-
-        # Insert prices
-        for _, row in df.iterrows():
-            price = InsurancePrice(
-                dataset_id=dataset.id,
-                age_min=int(row['age_min']),
-                age_max=int(row['age_max']),
-                zip_prefix=str(row['zip_prefix']),
-                insurance_model=str(row['insurance_model']).lower(),
-                deductible=int(row['deductible']),
-                accident_coverage=bool(row['accident_coverage']),
-                monthly_premium=float(row['monthly_premium']),
-                annual_premium=float(row['annual_premium']),
-                provider_name=str(row['provider_name']),
-                provider_code=str(row['provider_code']),
-            )
-            db.add(price)
+        db.commit()
+        dataset_id = dataset.id
 
+        # Rows go to the dataset's own table
+        table = create_partition(db, dataset)
         db.commit()
-        print(f"Loaded {len(df)} prices into dataset '{dataset.name}'")
-        return len(df)
+
+        # Normalize and insert chunk by chunk, committing each so no write
+        # transaction spans the whole load
+        start = time.perf_counter()
+        groups = defaultdict(set)
+        inserted = 0
+        for chunk in iter_frames(file_path, chunk_rows):
+            columns = normalize_frame(chunk)
+            collect_age_brackets(columns, groups)
+            inserted += bulk_insert_prices(db, dataset.id, columns, table)
+            db.commit()
+        print(f"Read {inserted} rows from {file_path}")
+        if not inserted:
+            raise ValueError(f"{file_path} contains no price rows")
+
+        # Reject overlapping/gapped age brackets before activating; groups
+        # may use different layouts, which are split into common segments
+        validate_groups(groups)
+        ages = segment_brackets(bracket for brackets in groups.values() for bracket in brackets)
+        assign_age_brackets(db, table, dataset.id, ages)
+
+        publish_dataset(db, dataset, ages, inserted)
+        elapsed = time.perf_counter() - start
+        print(
+            f"Loaded {inserted} prices into dataset '{dataset.name}' "
+            f"in {elapsed:.2f}s ({inserted / max(elapsed, 1e-9):,.0f} rows/sec)"
+        )
+        return inserted
 
     except Exception as e:
-        db.rollback()
+        if dataset_id is not None:
+            discard_dataset(db, dataset_id)
+        else:
+            db.rollback()
         raise e
     finally:
         db.close()
 
 
-def generate_sample_data() -> int:
+def publish_dataset(db: Session, dataset: PricingDataset, ages: AgeIntervalIndex, row_count: int) -> None:
+    """
+    Store what API workers need when they pick up a staged dataset (age table,
+    dropdown options, columnar snapshot), then activate it in one short transaction.
+    The snapshot is only a cache: if it cannot be written, workers rebuild it
+    (or index in memory), so the dataset is activated regardless.
+    """
+    dataset.row_count = row_count
+    dataset.age_brackets = [list(b) for b in ages.brackets]
+    dataset.age_lookup = dense_lookup(ages)
+    db.flush()
+    dataset.options = build_options(db, dataset.id, prices_table(dataset.storage_table))
+    db.commit()
+
+    start = time.perf_counter()
+    try:
+        size = write_dataset_snapshot(db, dataset)
+        print(f"Wrote {size:,} byte snapshot in {time.perf_counter() - start:.2f}s")
+    except OSError as e:
+        print(f"Warning: could not write snapshot for dataset {dataset.id}, workers will build it: {e}")
+
+    activate_dataset(db, dataset.id)
+
+
+# Sample data factors (Swiss health insurance)
+SAMPLE_PROVIDERS = [  # (name, code, base rate)
+    ("Helsana", "HEL", 1.0),
+    ("CSS", "CSS", 0.95),
+    ("Swica", "SWI", 1.05),
+    ("Sanitas", "SAN", 0.98),
+    ("Concordia", "CON", 0.92),
+]
+SAMPLE_AGE_BRACKETS = [(18, 25), (26, 35), (36, 45), (46, 55), (56, 65), (66, 100)]
+SAMPLE_ZIP_PREFIXES = ["800", "801", "802", "803", "810", "820", "830", "840", "850", "860"]
+SAMPLE_MODELS = {"basic": 1.0, "standard": 1.15, "premium": 1.35}
+SAMPLE_DEDUCTIBLES = [300, 500, 1000, 1500, 2000, 2500]
+
+
+def sample_providers(count: int) -> list:
+    """The Swiss insurers, then synthetic ones with varying base rates."""
+    extra = [
+        (f"Provider {i + 1}", f"P{i + 1:03d}", 0.9 + (i % 8) * 0.025)
+        for i in range(len(SAMPLE_PROVIDERS), count)
+    ]
+    return (SAMPLE_PROVIDERS + extra)[:count]
+
+
+def sample_zip_prefixes(count: int) -> list:
+    """The Swiss canton prefixes, then the remaining 3-digit prefixes in order."""
+    extra = [f"{p:03d}" for p in range(100, 1000) if f"{p:03d}" not in SAMPLE_ZIP_PREFIXES]
+    prefixes = (SAMPLE_ZIP_PREFIXES + extra)[:count]
+    if len(prefixes) < count:
+        raise ValueError(f"At most {len(SAMPLE_ZIP_PREFIXES) + len(extra)} ZIP prefixes available")
+    return prefixes
+
+
+def sample_age_brackets(count: int) -> list:
+    """The standard six brackets, or MIN_AGE..MAX_AGE split into count even brackets."""
+    if count == len(SAMPLE_AGE_BRACKETS):
+        return SAMPLE_AGE_BRACKETS
+    if not 1 <= count <= MAX_AGE - MIN_AGE + 1:
+        raise ValueError(f"Age brackets must be between 1 and {MAX_AGE - MIN_AGE + 1}")
+    edges = np.linspace(MIN_AGE, MAX_AGE + 1, count + 1).astype(int)
+    return [(int(lo), int(hi) - 1) for lo, hi in zip(edges, edges[1:])]
+
+
+def sample_price_chunks(providers: list, age_brackets: list, zip_prefixes: list,
+                        chunk_rows: int = CHUNK_ROWS) -> Iterator[PriceColumns]:
+    """
+    Cartesian product of provider x age bracket x ZIP x model x deductible x
+    accident, in that nesting order, as typed column chunks.
+    """
+    models = list(SAMPLE_MODELS)
+    provider_names = np.array([p[0] for p in providers], dtype=object)
+    provider_codes = np.array([p[1] for p in providers], dtype=object)
+    zip_array = np.array(zip_prefixes, dtype=object)
+    model_array = np.array(models, dtype=object)
+    age_min = np.array([lo for lo, _ in age_brackets])
+    age_max = np.array([hi for _, hi in age_brackets])
+    deductibles = np.array(SAMPLE_DEDUCTIBLES)
+
+    # Base rate varies by provider
+    provider_factor = np.array([p[2] for p in providers])
+    # Age affects price
+    age_factor = 1.0 + (age_min - 25) * 0.015
+    # Region affects price
+    region_factor = 0.9 + np.array([int(z[1]) for z in zip_prefixes]) * 0.02
+    # Model affects price
+    model_factor = np.array([SAMPLE_MODELS[m] for m in models])
+    # Higher deductible = lower premium
+    deductible_factor = 1.0 - (deductibles - 300) * 0.0002
+    # Accident coverage adds ~10%
+    accident_factor = np.array([1.0, 1.10])
+
+    shape = (len(providers), len(age_brackets), len(zip_prefixes), len(models), len(deductibles), 2)
+    total = int(np.prod(shape))
+
+    for start in range(0, total, chunk_rows):
+        p, a, z, m, d, acc = np.unravel_index(np.arange(start, min(start + chunk_rows, total)), shape)
+
+        base_monthly = 280  # CHF base
+        monthly = (
+            base_monthly
+            * provider_factor[p]
+            * age_factor[a]
+            * region_factor[z]
+            * model_factor[m]
+            * deductible_factor[d]
+            * accident_factor[acc]
+        )
+
+        yield {
+            'age_min': age_min[a],
+            'age_max': age_max[a],
+            'age_bracket': a,
+            'zip_prefix': zip_array[z],
+            'insurance_model': model_array[m],
+            'deductible': deductibles[d],
+            'accident_coverage': acc.astype(bool),
+            'monthly_premium': monthly.round(2),
+            'annual_premium': (monthly * 12).round(2),
+            'provider_name': provider_names[p],
+            'provider_code': provider_codes[p],
+        }
+
+
+def generate_sample_data(providers: int = len(SAMPLE_PROVIDERS),
+                         zip_prefixes: int = len(SAMPLE_ZIP_PREFIXES),
+                         age_brackets: int = len(SAMPLE_AGE_BRACKETS)) -> int:
     """
     Generate sample pricing data for demo purposes.
-    Creates realistic Swiss health insurance pricing.
+    Creates realistic Swiss health insurance pricing; raise the counts to
+    build large datasets for load testing (rows = 36 x providers x
+    zip_prefixes x age_brackets).
     """
     db = SessionLocal()
     init_db()
+    dataset_id = None
 
     try:
-        # Deactivate old
-        db.query(PricingDataset).update({PricingDataset.is_active: False})
+        ages = AgeIntervalIndex(sample_age_brackets(age_brackets))
+        chunks = sample_price_chunks(
+            sample_providers(providers), ages.brackets, sample_zip_prefixes(zip_prefixes)
+        )
 
-        # Create sample dataset
+        # Create sample dataset, staged until fully written
         dataset = PricingDataset(
             name="Demo Pricing Data",
-            is_active=True,
+            is_active=False,
             row_count=0,
         )
         db.add(dataset)
-        db.flush()
-
-        # Sample providers (Swiss insurers)
-        providers = [
-            ("Helsana", "HEL"),
-            ("CSS", "CSS"),
-            ("Swica", "SWI"),
-            ("Sanitas", "SAN"),
-            ("Concordia", "CON"),
-        ]
-
-        # Age brackets
-        age_brackets = [
-            (18, 25),
-            (26, 35),
-            (36, 45),
-            (46, 55),
-            (56, 65),
-            (66, 100),
-        ]
-
-        # ZIP prefixes (Swiss cantons)
-        zip_prefixes = ["800", "801", "802", "803", "810", "820", "830", "840", "850", "860"]
-
-        # Insurance models
-        models = ["basic", "standard", "premium"]
-
-        # Deductibles (Swiss standard)
-        deductibles = [300, 500, 1000, 1500, 2000, 2500]
+        db.commit()
+        dataset_id = dataset.id
 
-        count = 0
-        for provider_name, provider_code in providers:
-            # Base rate varies by provider
-            provider_base = {"HEL": 1.0, "CSS": 0.95, "SWI": 1.05, "SAN": 0.98, "CON": 0.92}[provider_code]
-
-            for age_min, age_max in age_brackets:
-                # Age affects price
-                age_factor = 1.0 + (age_min - 25) * 0.015
-
-                for zip_prefix in zip_prefixes:
-                    # Region affects price
-                    region_factor = 0.9 + (int(zip_prefix[1]) * 0.02)
-
-                    for model in models:
-                        # Model affects price
-                        model_factor = {"basic": 1.0, "standard": 1.15, "premium": 1.35}[model]
-
-                        for deductible in deductibles:
-                            # Higher deductible = lower premium
-                            deductible_factor = 1.0 - (deductible - 300) * 0.0002
-
-                            for accident in [False, True]:
-                                # Accident coverage adds ~10%
-                                accident_factor = 1.10 if accident else 1.0
-
-                                # Calculate premium
-                                base_monthly = 280  # CHF base
-                                monthly = (
-                                    base_monthly
-                                    * provider_base
-                                    * age_factor
-                                    * region_factor
-                                    * model_factor
-                                    * deductible_factor
-                                    * accident_factor
-                                )
-
-                                price = InsurancePrice(
-                                    dataset_id=dataset.id,
-                                    age_min=age_min,
-                                    age_max=age_max,
-                                    zip_prefix=zip_prefix,
-                                    insurance_model=model,
-                                    deductible=deductible,
-                                    accident_coverage=accident,
-                                    monthly_premium=round(monthly, 2),
-                                    annual_premium=round(monthly * 12, 2),
-                                    provider_name=provider_name,
-                                    provider_code=provider_code,
-                                )
-                                db.add(price)
-                                count += 1
-
-        dataset.row_count = count
+        table = create_partition(db, dataset)
         db.commit()
-        print(f"Generated {count} sample price rows")
+
+        start = time.perf_counter()
+        count = 0
+        for columns in chunks:
+            count += bulk_insert_prices(db, dataset.id, columns, table)
+            db.commit()
+
+        publish_dataset(db, dataset, ages, count)
+        elapsed = time.perf_counter() - start
+        print(f"Generated {count} sample price rows in {elapsed:.2f}s ({count / max(elapsed, 1e-9):,.0f} rows/sec)")
         return count
 
     except Exception as e:
-        db.rollback()
+        if dataset_id is not None:
+            discard_dataset(db, dataset_id)
+        else:
+            db.rollback()
         raise e
     finally:
         db.close()
 
 
 if __name__ == "__main__":
-    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Load a price sheet, or generate sample data.")
+    parser.add_argument("file", nargs="?", help="Excel/CSV/Parquet price sheet (omit for sample data)")
+    parser.add_argument("--name", help="Dataset name for a loaded sheet")
+    parser.add_argument("--providers", type=int, default=len(SAMPLE_PROVIDERS))
+    parser.add_argument("--zip-prefixes", type=int, default=len(SAMPLE_ZIP_PREFIXES))
+    parser.add_argument("--age-brackets", type=int, default=len(SAMPLE_AGE_BRACKETS))
+    parser.add_argument("--retain", type=int, nargs="?", const=RETAIN_DATASETS, metavar="N",
+                        help=f"keep only the newest N datasets (default {RETAIN_DATASETS}) and compact; "
+                             "runs after the load, or alone when no file is given")
+    args = parser.parse_args()
+
+    # Existing databases get the current columns and index set before loading
+    from database import engine
+    from indexes import migrate_columns, migrate_indexes
+    init_db()
+    migrate_columns(engine)
+    migrate_indexes(engine)
 
-    if len(sys.argv) > 1:
+    if args.file:
         # Load from Excel
-        load_excel_pricing(sys.argv[1])
-    else:
+        load_excel_pricing(args.file, args.name)
+    elif args.retain is None:
         # Generate sample data
-        generate_sample_data()
+        generate_sample_data(args.providers, args.zip_prefixes, args.age_brackets)
+
+    if args.retain is not None:
+        db = SessionLocal()
+        try:
+            report = run_retention(db, engine, keep=args.retain)
+        finally:
+            db.close()
+        print(
+            f"Removed {len(report.removed_datasets)} datasets ({report.removed_rows} rows), "
+            f"reclaimed {report.bytes_reclaimed:,} bytes "
+            f"({report.bytes_before:,} -> {report.bytes_after:,})"
+        )
@@ -4,18 +4,30 @@ Real-time insurance premium quotes from Excel-driven database.
 
 Endpoints:
 - POST /api/prices/quote - Get quote for single configuration
+- POST /api/prices/quote/batch - Get quotes for many configurations at once
 - POST /api/prices/compare - Compare quotes across providers
+- GET /metrics - Prometheus metrics
 """
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, Header, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
 from pydantic import BaseModel, Field
+from prometheus_client import REGISTRY
 from typing import Optional, List
-from datetime import datetime
-
-from database import get_db, init_db
-from models import InsurancePrice, PricingDataset, Provider
+import base64
+import time
+
+from age_index import MAX_AGE, MIN_AGE
+from active_dataset import ActiveDataset, dataset_cache
+from database import DB_MODE, SessionLocal, async_engine, engine, get_async_db, get_db, init_db, pool_metrics
+from metrics import MetricsMiddleware, PricingCollector, instrument_engine, phase, render_metrics
+from options import EMPTY_OPTIONS, etag_matches, options_cache
+from fast_json import dumps, join_array
+from indexes import migrate_columns
+from quote_engine import quote_engine
+from response_cache import response_cache
+from retention import start_background_retention
 
 app = FastAPI(
     title="Lamalux Pricing API",
@@ -32,11 +44,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so latency covers CORS handling too
+app.add_middleware(MetricsMiddleware, routes=app.routes)
+
+instrument_engine(engine)
+if async_engine is not None:
+    instrument_engine(async_engine.sync_engine)
+
+REGISTRY.register(PricingCollector(pool_metrics, {
+    "active_dataset": dataset_cache,
+    "options": options_cache,
+    "response": response_cache,
+}, dataset_cache))
+
 
 # === Request/Response Models ===
 
+# Upper bound on configurations per batch quote call
+MAX_BATCH_QUOTES = 200
+
+# Upper bound on quotes per compare page
+MAX_COMPARE_LIMIT = 500
+
+
 class QuoteRequest(BaseModel):
-    age: int = Field(..., ge=18, le=100, description="Customer age")
+    age: int = Field(..., ge=MIN_AGE, le=MAX_AGE, description="Customer age")
     zip_code: str = Field(..., min_length=5, max_length=5, description="5-digit ZIP code")
     insurance_model: str = Field(..., description="basic, standard, or premium")
     deductible: int = Field(..., description="Deductible amount (300, 500, 1000, 2500)")
@@ -53,173 +85,284 @@ class QuoteResponse(BaseModel):
     accident_coverage: bool
 
 
+class BatchQuoteRequest(BaseModel):
+    quotes: List[QuoteRequest] = Field(..., max_length=MAX_BATCH_QUOTES)
+
+
+class BatchQuoteResult(BaseModel):
+    quotes: List[QuoteResponse]
+    error: Optional[str] = None  # Set instead of a 404 when nothing matches
+
+
+class BatchQuoteResponse(BaseModel):
+    results: List[BatchQuoteResult]  # Same order as the request
+
+
 class CompareRequest(BaseModel):
-    age: int = Field(..., ge=18, le=100)
+    age: int = Field(..., ge=MIN_AGE, le=MAX_AGE)
     zip_code: str = Field(..., min_length=5, max_length=5)
     insurance_model: Optional[str] = None  # If None, compare all models
     deductible: Optional[int] = None  # If None, compare all deductibles
     accident_coverage: bool = False
+    limit: Optional[int] = Field(default=None, ge=1, le=MAX_COMPARE_LIMIT,
+                                 description="Return only the N cheapest quotes (top K)")
+    cursor: Optional[str] = Field(default=None, description="next_cursor of the previous page")
 
 
 class CompareResponse(BaseModel):
     quotes: List[QuoteResponse]
-    cheapest: Optional[QuoteResponse]
+    cheapest: Optional[QuoteResponse]  # Cheapest overall, on every page
+    next_cursor: Optional[str] = None  # Set when a limit left more quotes
     query_time_ms: float
 
 
+# Dependency - cached active dataset; only hits the DB when the cache is stale.
+# DB_MODE picks a threadpool Session or an AsyncSession for that check.
+if DB_MODE == "async":
+    async def get_active_dataset(db: AsyncSession = Depends(get_async_db)) -> Optional[ActiveDataset]:
+        with phase("dataset"):
+            if dataset_cache.fresh:
+                dataset_cache.hits += 1
+                return dataset_cache.dataset
+            return await db.run_sync(dataset_cache.resolve)
+else:
+    def get_active_dataset(db: Session = Depends(get_db)) -> Optional[ActiveDataset]:
+        with phase("dataset"):
+            return dataset_cache.resolve(db)
+
+
+# Response bodies are assembled from the index's pre-encoded rows (Rows.json()),
+# in the shape of the response_model declared on each route
+
+def json_response(body: bytes) -> Response:
+    return Response(content=body, media_type="application/json")
+
+
+def compare_prefix(prices, cheapest=None, next_cursor: Optional[str] = None) -> bytes:
+    """CompareResponse body without query_time_ms and the closing brace."""
+    if cheapest is None and prices:
+        cheapest = prices[0]
+    return b'{"quotes":%s,"cheapest":%s,"next_cursor":%s' % (
+        join_array(prices.json()),
+        cheapest.json if cheapest else b"null",
+        dumps(next_cursor),
+    )
+
+
+def compare_body(prefix: bytes, elapsed_ms: float) -> bytes:
+    """Complete a compare_prefix() with this request's timing."""
+    return b'%s,"query_time_ms":%s}' % (prefix, dumps(round(elapsed_ms, 2)))
+
+
+def encode_cursor(dataset_id: int, offset: int) -> str:
+    """Opaque compare page cursor, tied to the dataset it was issued for."""
+    return base64.urlsafe_b64encode(f"{dataset_id}:{offset}".encode()).decode()
+
+
+def decode_cursor(cursor: str, dataset_id: int) -> int:
+    """Offset of a compare page cursor; 400 if it is malformed or from another dataset."""
+    try:
+        issued_for, offset = (int(part) for part in base64.urlsafe_b64decode(cursor).split(b":"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if issued_for != dataset_id or offset < 0:
+        raise HTTPException(status_code=400, detail="Cursor expired: prices were updated, start from the first page")
+    return offset
+
+
+def no_quotes_detail(request: QuoteRequest) -> str:
+    return f"No quotes found for ZIP {request.zip_code[:3]}*, age {request.age}, {request.insurance_model}"
+
+
 # === API Endpoints ===
 
 @app.post("/api/prices/quote", response_model=List[QuoteResponse])
-def get_quote(request: QuoteRequest, db: Session = Depends(get_db)):
+async def get_quote(request: QuoteRequest, active: Optional[ActiveDataset] = Depends(get_active_dataset)):
     """
     Get insurance quotes for a specific configuration.
     Returns all matching providers.
     """
     zip_prefix = request.zip_code[:3]
 
-    # Query active dataset
-    active_dataset = db.query(PricingDataset).filter(
-        PricingDataset.is_active == True
-    ).first()
+    # Served from the in-memory index of the active dataset
+    index = quote_engine.index
 
-    if not active_dataset:
+    if not active or not index:
         raise HTTPException(status_code=404, detail="No active pricing dataset")
 
-    # Find matching prices (ORM query, no raw SQL)
-    prices = db.query(InsurancePrice).filter(
-        and_(
-            InsurancePrice.dataset_id == active_dataset.id,
-            InsurancePrice.zip_prefix == zip_prefix,
-            InsurancePrice.insurance_model == request.insurance_model,
-            InsurancePrice.deductible == request.deductible,
-            InsurancePrice.accident_coverage == request.accident_coverage,
-            InsurancePrice.age_min <= request.age,
-            InsurancePrice.age_max >= request.age,
+    # Everything the lookup depends on, with ZIP and age normalized
+    key = ("quote", index.dataset_id, zip_prefix, request.insurance_model, request.deductible,
+           request.accident_coverage, index.age_bracket(request.age))
+    with phase("cache"):
+        body = response_cache.get(key)
+    if body is not None:
+        return json_response(body)
+
+    with phase("query"):
+        prices = index.quote(
+            zip_prefix,
+            request.insurance_model,
+            request.deductible,
+            request.accident_coverage,
+            request.age,
         )
-    ).all()
 
     if not prices:
-        raise HTTPException(
-            status_code=404,
-            detail=f"No quotes found for ZIP {zip_prefix}*, age {request.age}, {request.insurance_model}"
-        )
+        raise HTTPException(status_code=404, detail=no_quotes_detail(request))
+
+    with phase("serialize"):
+        body = join_array(prices.json())
+
+    response_cache.put(key, body)
+    return json_response(body)
 
-    return [
-        QuoteResponse(
-            provider_name=p.provider_name,
-            provider_code=p.provider_code,
-            monthly_premium=round(p.monthly_premium, 2),
-            annual_premium=round(p.annual_premium, 2),
-            deductible=p.deductible,
-            insurance_model=p.insurance_model,
-            accident_coverage=p.accident_coverage,
+
+@app.post("/api/prices/quote/batch", response_model=BatchQuoteResponse)
+async def get_quotes_batch(batch: BatchQuoteRequest, active: Optional[ActiveDataset] = Depends(get_active_dataset)):
+    """
+    Get quotes for many configurations in one call.
+    Results are positional; configurations without quotes carry an error.
+    """
+    index = quote_engine.index
+
+    if not active or not index:
+        raise HTTPException(status_code=404, detail="No active pricing dataset")
+
+    with phase("query"):
+        matches = [
+            index.quote(
+                request.zip_code[:3],
+                request.insurance_model,
+                request.deductible,
+                request.accident_coverage,
+                request.age,
+            )
+            for request in batch.quotes
+        ]
+
+    with phase("serialize"):
+        results = join_array(
+            b'{"quotes":%s,"error":%s}' % (
+                join_array(prices.json()),
+                b"null" if prices else dumps(no_quotes_detail(request)),
+            )
+            for request, prices in zip(batch.quotes, matches)
         )
-        for p in prices
-    ]
+
+    return json_response(b'{"results":%s}' % results)
 
 
 @app.post("/api/prices/compare", response_model=CompareResponse)
-def compare_quotes(request: CompareRequest, db: Session = Depends(get_db)):
+async def compare_quotes(request: CompareRequest, active: Optional[ActiveDataset] = Depends(get_active_dataset)):
     """
     Compare quotes across providers and configurations.
-    Returns all matching quotes sorted by price, plus the cheapest option.
+    Returns matching quotes sorted by price, plus the cheapest option.
+    With a limit only the cheapest N are returned; next_cursor fetches the next N.
     """
-    import time
-    start = time.time()
+    start = time.perf_counter_ns()
 
     zip_prefix = request.zip_code[:3]
 
-    active_dataset = db.query(PricingDataset).filter(
-        PricingDataset.is_active == True
-    ).first()
+    index = quote_engine.index
 
-    if not active_dataset:
+    if not active or not index:
         raise HTTPException(status_code=404, detail="No active pricing dataset")
 
-    # Build query filters
-    filters = [
-        InsurancePrice.dataset_id == active_dataset.id,
-        InsurancePrice.zip_prefix == zip_prefix,
-        InsurancePrice.accident_coverage == request.accident_coverage,
-        InsurancePrice.age_min <= request.age,
-        InsurancePrice.age_max >= request.age,
-    ]
-
-    if request.insurance_model:
-        filters.append(InsurancePrice.insurance_model == request.insurance_model)
-
-    if request.deductible:
-        filters.append(InsurancePrice.deductible == request.deductible)
-
-    # Query and sort by price
-    prices = db.query(InsurancePrice).filter(
-        and_(*filters)
-    ).order_by(InsurancePrice.monthly_premium).all()
-
-    quotes = [
-        QuoteResponse(
-            provider_name=p.provider_name,
-            provider_code=p.provider_code,
-            monthly_premium=round(p.monthly_premium, 2),
-            annual_premium=round(p.annual_premium, 2),
-            deductible=p.deductible,
-            insurance_model=p.insurance_model,
-            accident_coverage=p.accident_coverage,
+    offset = decode_cursor(request.cursor, index.dataset_id) if request.cursor else 0
+
+    # index.compare treats empty model / zero deductible as "any"
+    key = ("compare", index.dataset_id, zip_prefix, request.accident_coverage,
+           index.age_bracket(request.age), request.insurance_model or None, request.deductible or None,
+           request.limit, offset)
+    with phase("cache"):
+        cached = response_cache.get(key)
+    if cached is not None:
+        return json_response(compare_body(cached, (time.perf_counter_ns() - start) / 1e6))
+
+    # Already sorted by monthly premium
+    with phase("query"):
+        prices = index.compare(
+            zip_prefix,
+            request.accident_coverage,
+            request.age,
+            insurance_model=request.insurance_model,
+            deductible=request.deductible,
         )
-        for p in prices
-    ]
 
-    elapsed_ms = (time.time() - start) * 1000
+    # The view is sorted, so a page is a slice: O(limit), not O(matches)
+    next_cursor = None
+    cheapest = prices[0] if prices else None
+    if request.limit is not None or offset:
+        end = offset + request.limit if request.limit is not None else len(prices)
+        if end < len(prices):
+            next_cursor = encode_cursor(index.dataset_id, end)
+        prices = prices[offset:end]
 
-    return CompareResponse(
-        quotes=quotes,
-        cheapest=quotes[0] if quotes else None,
-        query_time_ms=round(elapsed_ms, 2),
-    )
+    # Cached without the timing, which differs per request
+    with phase("serialize"):
+        cached = compare_prefix(prices, cheapest, next_cursor)
+    response_cache.put(key, cached)
+
+    # Handler time; the full breakdown is in Server-Timing
+    return json_response(compare_body(cached, (time.perf_counter_ns() - start) / 1e6))
 
 
 @app.get("/api/health")
-def health_check(db: Session = Depends(get_db)):
+async def health_check(active: Optional[ActiveDataset] = Depends(get_active_dataset)):
     """Health check - verify DB connection and active dataset."""
-    active = db.query(PricingDataset).filter(PricingDataset.is_active == True).first()
     return {
         "status": "healthy",
         "active_dataset": active.name if active else None,
         "row_count": active.row_count if active else 0,
+        "db_pool": pool_metrics.snapshot(),
+        "response_cache": response_cache.stats(),
+        "quote_index": quote_engine.stats(),
     }
 
 
 @app.get("/api/options")
-def get_options(db: Session = Depends(get_db)):
+async def get_options(
+    if_none_match: Optional[str] = Header(default=None),
+    active: Optional[ActiveDataset] = Depends(get_active_dataset),
+):
     """Return available options for the UI dropdowns."""
-    active = db.query(PricingDataset).filter(PricingDataset.is_active == True).first()
-    if not active:
-        return {"insurance_models": [], "deductibles": [], "providers": []}
+    options = options_cache.payload
+    if not active or not options:
+        return EMPTY_OPTIONS
 
-    # Get distinct values from active dataset
-    models = db.query(InsurancePrice.insurance_model).filter(
-        InsurancePrice.dataset_id == active.id
-    ).distinct().all()
+    # Precomputed per dataset - clients revalidate and usually get a 304
+    headers = {"ETag": options.etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, options.etag):
+        options_cache.hits += 1
+        return Response(status_code=304, headers=headers)
 
-    deductibles = db.query(InsurancePrice.deductible).filter(
-        InsurancePrice.dataset_id == active.id
-    ).distinct().order_by(InsurancePrice.deductible).all()
+    options_cache.misses += 1
+    return Response(content=options.body, media_type="application/json", headers=headers)
 
-    providers = db.query(InsurancePrice.provider_name, InsurancePrice.provider_code).filter(
-        InsurancePrice.dataset_id == active.id
-    ).distinct().all()
 
-    return {
-        "insurance_models": [m[0] for m in models],
-        "deductibles": [d[0] for d in deductibles],
-        "providers": [{"name": p[0], "code": p[1]} for p in providers],
-    }
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
 
 
 # Initialize DB on startup
 @app.on_event("startup")
 def startup():
     init_db()
+    # Databases from older versions lack columns the dataset cache reads
+    migrate_columns(engine)
+    dataset_cache.subscribe(quote_engine.load)
+    dataset_cache.subscribe(options_cache.load)
+    dataset_cache.subscribe(response_cache.on_dataset_change)
+    db = SessionLocal()
+    try:
+        dataset_cache.resolve(db)
+    finally:
+        db.close()
+
+    # Off unless RETENTION_INTERVAL_SECONDS is set
+    start_background_retention(SessionLocal, engine)
 
 
 if __name__ == "__main__":
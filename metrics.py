@@ -0,0 +1,222 @@
+"""
+Prometheus metrics for the pricing API.
+
+MetricsMiddleware is a plain ASGI middleware (no BaseHTTPMiddleware task
+overhead) recording per-route latency, status counts and in-flight
+requests. Handlers time request phases (dataset, cache, query, serialize;
+db is summed from SQLAlchemy cursor events) with perf_counter_ns; they are
+exported as histograms and returned to the client in a Server-Timing
+header on every response. State owned by
+other modules (pool, caches, active dataset) is read at scrape time by
+PricingCollector, so the request path never touches it.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, HistogramMetricFamily
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+REQUEST_LATENCY = Histogram(
+    "pricing_http_request_duration_seconds",
+    "HTTP request latency by route",
+    ["method", "route"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUESTS = Counter(
+    "pricing_http_requests_total",
+    "HTTP requests by route and status",
+    ["method", "route", "status"],
+)
+IN_FLIGHT = Gauge(
+    "pricing_http_requests_in_flight",
+    "HTTP requests currently being served",
+)
+PHASE_LATENCY = Histogram(
+    "pricing_request_phase_duration_seconds",
+    "Time spent per request phase (dataset, cache, query, serialize, db)",
+    ["route", "phase"],
+    buckets=LATENCY_BUCKETS,
+)
+
+
+class RequestTimings:
+    """
+    Per-request phase totals in nanoseconds, shared with threadpool code via
+    a ContextVar. Phases keep the order they were first recorded in.
+    """
+    __slots__ = ("start_ns", "phases")
+
+    def __init__(self):
+        self.start_ns = time.perf_counter_ns()
+        self.phases: Dict[str, int] = {}
+
+    def add(self, phase: str, ns: int) -> None:
+        self.phases[phase] = self.phases.get(phase, 0) + ns
+
+    def server_timing(self) -> bytes:
+        """Server-Timing header value, durations in milliseconds."""
+        total_ns = time.perf_counter_ns() - self.start_ns
+        entries = [f"{name};dur={ns / 1e6:.3f}" for name, ns in self.phases.items()]
+        entries.append(f"total;dur={total_ns / 1e6:.3f}")
+        return ", ".join(entries).encode("latin-1")
+
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+def record_phase(phase: str, ns: int) -> None:
+    timings = _current.get()
+    if timings is not None:
+        timings.add(phase, ns)
+
+
+@contextmanager
+def phase(name: str):
+    """Time a block as a phase of the current request."""
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        record_phase(name, time.perf_counter_ns() - start)
+
+
+class MetricsMiddleware:
+    def __init__(self, app, routes=()):
+        self.app = app
+        # Older Starlette only sets scope["endpoint"], not scope["route"]
+        self._endpoint_paths = {getattr(r, "endpoint", None): r.path for r in routes}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        timings = RequestTimings()
+        token = _current.set(timings)
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [
+                    *message.get("headers", ()),
+                    (b"server-timing", timings.server_timing()),
+                    # Lets cross-origin pages read the timings in devtools / Resource Timing
+                    (b"timing-allow-origin", b"*"),
+                ]
+            await send(message)
+
+        IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            IN_FLIGHT.dec()
+            _current.reset(token)
+
+            route = self._route_label(scope)
+            method = scope["method"]
+            REQUEST_LATENCY.labels(method, route).observe((time.perf_counter_ns() - timings.start_ns) / 1e9)
+            REQUESTS.labels(method, route, str(status)).inc()
+            for name, ns in timings.phases.items():
+                PHASE_LATENCY.labels(route, name).observe(ns / 1e9)
+
+    def _route_label(self, scope) -> str:
+        route = scope.get("route")
+        if route is not None:
+            return route.path
+        return self._endpoint_paths.get(scope.get("endpoint"), "unmatched")
+
+
+def instrument_engine(sync_engine) -> None:
+    """Add each statement's execution time to the current request's db phase."""
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_start"] = time.perf_counter_ns()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info.pop("query_start", None)
+        if start is not None:
+            record_phase("db", time.perf_counter_ns() - start)
+
+
+class PricingCollector:
+    """Exports pool, cache and active-dataset state at scrape time."""
+
+    def __init__(self, pool_metrics, caches: Dict[str, object], dataset_cache):
+        """caches: name -> object with integer hits/misses attributes."""
+        self.pool_metrics = pool_metrics
+        self.caches = caches
+        self.dataset_cache = dataset_cache
+
+    def collect(self):
+        dataset = self.dataset_cache.dataset
+        yield GaugeMetricFamily(
+            "pricing_active_dataset_id", "ID of the active pricing dataset (0 = none)",
+            value=dataset.id if dataset else 0,
+        )
+        yield GaugeMetricFamily(
+            "pricing_active_dataset_rows", "Price rows in the active dataset",
+            value=dataset.row_count if dataset else 0,
+        )
+
+        cache = CounterMetricFamily(
+            "pricing_cache_requests", "Cache lookups by cache and result", labels=["cache", "result"],
+        )
+        ratio = GaugeMetricFamily(
+            "pricing_cache_hit_ratio", "Hits / lookups since start", labels=["cache"],
+        )
+        evictions = CounterMetricFamily(
+            "pricing_cache_evictions", "Entries dropped by cache and reason", labels=["cache", "reason"],
+        )
+        entries = GaugeMetricFamily("pricing_cache_entries", "Entries currently cached", labels=["cache"])
+        for name, tracked in self.caches.items():
+            cache.add_metric([name, "hit"], tracked.hits)
+            cache.add_metric([name, "miss"], tracked.misses)
+            lookups = tracked.hits + tracked.misses
+            ratio.add_metric([name], tracked.hits / lookups if lookups else 0.0)
+            # Bounded caches also report size and evictions
+            if hasattr(tracked, "evictions"):
+                evictions.add_metric([name, "size"], tracked.evictions)
+                evictions.add_metric([name, "ttl"], tracked.expirations)
+                entries.add_metric([name], len(tracked))
+        yield cache
+        yield ratio
+        yield evictions
+        yield entries
+
+        pool = self.pool_metrics
+        stats = pool.snapshot()
+        for name, help_text in (
+            ("size", "Connections kept in the pool"),
+            ("checked_out", "Connections currently in use"),
+            ("overflow", "Connections open beyond pool size"),
+        ):
+            yield GaugeMetricFamily(f"pricing_db_pool_{name}", help_text, value=stats[name])
+        yield CounterMetricFamily(
+            "pricing_db_pool_overflow_events", "Overflow connections opened", value=stats["overflow_events"],
+        )
+        yield CounterMetricFamily(
+            "pricing_db_pool_timeouts", "Checkouts that timed out waiting for a connection", value=stats["timeouts"],
+        )
+
+        cumulative, buckets = 0, []
+        for bound, count in zip(list(pool.BUCKETS) + [float("inf")], pool.bucket_counts):
+            cumulative += count
+            buckets.append(("+Inf" if bound == float("inf") else str(bound), cumulative))
+        yield HistogramMetricFamily(
+            "pricing_db_pool_checkout_duration_seconds", "Time to check out a pooled connection",
+            buckets=buckets, sum_value=pool.checkout_seconds,
+        )
+
+
+def render_metrics():
+    """Body and content type for the /metrics endpoint."""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
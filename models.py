@@ -2,7 +2,7 @@
 SQLAlchemy ORM models for insurance pricing.
 No raw SQL - pure ORM as requested.
 """
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Index
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Index, JSON
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -20,9 +20,36 @@ class PricingDataset(Base):
     is_active = Column(Boolean, default=True)
     row_count = Column(Integer, default=0)
 
+    # Materialized at load time: the age segments all groups' brackets split
+    # into (age_index.segment_brackets), [[age_min, age_max], ...] in ordinal
+    # order, and the segment ordinal for every age from MIN_AGE to MAX_AGE (-1 = none)
+    age_brackets = Column(JSON)
+    age_lookup = Column(JSON)
+
+    # UI dropdown options, computed once when the dataset is loaded
+    options = Column(JSON)
+
+    # Table holding this dataset's price rows (see storage.py);
+    # NULL = the shared insurance_prices table
+    storage_table = Column(String)
+
     prices = relationship("InsurancePrice", back_populates="dataset")
 
 
+class DatasetVersion(Base):
+    """
+    Single row pointing at the active dataset, with a generation counter
+    bumped on every activation. API workers poll it instead of re-querying
+    pricing_datasets.
+    """
+    __tablename__ = "dataset_version"
+
+    id = Column(Integer, primary_key=True)  # Always 1
+    generation = Column(Integer, nullable=False, default=0)
+    active_dataset_id = Column(Integer, ForeignKey("pricing_datasets.id"))
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
 class InsurancePrice(Base):
     """
     Core pricing table - one row per unique combination.
@@ -36,6 +63,7 @@ class InsurancePrice(Base):
     # Lookup keys (what the UI sends)
     age_min = Column(Integer, nullable=False)
     age_max = Column(Integer, nullable=False)
+    age_bracket = Column(Integer)  # Ordinal into PricingDataset.age_brackets of the segment age_min starts
     zip_prefix = Column(String(3), nullable=False)  # First 3 digits of ZIP
     insurance_model = Column(String, nullable=False)  # e.g., "basic", "standard", "premium"
     deductible = Column(Integer, nullable=False)  # e.g., 300, 500, 1000, 2500
@@ -49,10 +77,14 @@ class InsurancePrice(Base):
 
     dataset = relationship("PricingDataset", back_populates="prices")
 
-    # Indexes for fast queries
+    # Indexes for the queries that still reach this table (see indexes.py);
+    # quote/compare lookups are served from memory
     __table_args__ = (
-        Index('idx_pricing_lookup', 'dataset_id', 'zip_prefix', 'insurance_model', 'deductible'),
-        Index('idx_age_range', 'age_min', 'age_max'),
+        # Whole-dataset scans in insertion order (quote index build), dataset deletes/updates
+        Index('idx_prices_dataset', 'dataset_id', 'id'),
+        # Covers the DISTINCT option queries - index-only, no table reads
+        Index('idx_prices_options', 'dataset_id', 'insurance_model', 'deductible',
+              'provider_name', 'provider_code'),
     )
 
 
@@ -0,0 +1,96 @@
+"""
+UI dropdown options for a pricing dataset.
+Computed once when the loader activates a dataset and stored with it;
+the API serves the pre-serialized payload with an ETag.
+"""
+from typing import Dict, NamedTuple, Optional
+
+from sqlalchemy import Select, Table, select
+from sqlalchemy.orm import Session
+
+from active_dataset import ActiveDataset
+from fast_json import dumps
+from models import InsurancePrice, PricingDataset
+from storage import dataset_filter, prices_table
+
+EMPTY_OPTIONS = {"insurance_models": [], "deductibles": [], "providers": []}
+
+
+def option_queries(dataset_id: int, table: Table = InsurancePrice.__table__) -> Dict[str, Select]:
+    """Distinct models, deductibles and providers of a dataset stored in table."""
+    c = table.c
+    rows = dataset_filter(table, dataset_id)
+    return {
+        "models": select(c.insurance_model).where(*rows).distinct().order_by(c.insurance_model),
+        "deductibles": select(c.deductible).where(*rows).distinct().order_by(c.deductible),
+        "providers": select(c.provider_name, c.provider_code).where(*rows).distinct().order_by(
+            c.provider_name, c.provider_code
+        ),
+    }
+
+
+def build_options(db: Session, dataset_id: int, table: Table = InsurancePrice.__table__) -> dict:
+    """Dropdown options of a dataset, as stored in PricingDataset.options."""
+    queries = option_queries(dataset_id, table)
+    models = db.execute(queries["models"]).all()
+    deductibles = db.execute(queries["deductibles"]).all()
+    providers = db.execute(queries["providers"]).all()
+
+    return {
+        "insurance_models": [m[0] for m in models],
+        "deductibles": [d[0] for d in deductibles],
+        "providers": [{"name": p[0], "code": p[1]} for p in providers],
+    }
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match check (weak comparison, as RFC 9110 requires for it)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = (t.strip() for t in if_none_match.split(","))
+    return etag in (t[2:] if t.startswith("W/") else t for t in tags)
+
+
+def dataset_etag(dataset: ActiveDataset) -> str:
+    """Strong ETag for data that is fixed per dataset.
+    Upload time is included so a rebuilt DB reusing IDs cannot produce false 304s."""
+    uploaded = int(dataset.uploaded_at.timestamp()) if dataset.uploaded_at else 0
+    return f'"dataset-{dataset.id}-{uploaded}"'
+
+
+class OptionsPayload(NamedTuple):
+    body: bytes
+    etag: str
+
+
+class OptionsCache:
+    """Serialized options for the active dataset, rebuilt on dataset change."""
+
+    def __init__(self):
+        self.payload: Optional[OptionsPayload] = None
+        # Conditional requests answered with 304 vs full bodies served
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, db: Session, dataset: Optional[ActiveDataset]) -> None:
+        if not dataset:
+            self.payload = None
+            return
+
+        options = db.query(PricingDataset.options).filter(
+            PricingDataset.id == dataset.id
+        ).scalar()
+
+        # Datasets loaded before options were stored get them computed once here
+        if options is None:
+            options = build_options(db, dataset.id, prices_table(dataset.storage_table))
+
+        self.payload = OptionsPayload(
+            body=dumps(options),
+            etag=dataset_etag(dataset),
+        )
+
+
+options_cache = OptionsCache()
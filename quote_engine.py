@@ -0,0 +1,411 @@
+"""
+Quote engine for the active pricing dataset.
+Prices only change when loader.py runs, so every quote/compare lookup is
+served from a precomputed index over the dataset's snapshot (see
+snapshot.py). The index arrays live in the mapped snapshot file, so all
+uvicorn workers share one copy of them instead of holding one each.
+"""
+import logging
+import tempfile
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from age_index import MAX_AGE, MIN_AGE, AgeIntervalIndex, dense_lookup, segment_brackets
+from active_dataset import ActiveDataset
+from fast_json import dumps
+from snapshot import (
+    SNAPSHOT_BATCH_ROWS, SNAPSHOT_DIR, Column, Snapshot, SnapshotError, collect_columns, dataset_columns,
+    open_dataset_snapshot, smallest_uint, snapshot_lock, snapshot_path, write_snapshot,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class PriceRow(NamedTuple):
+    """One price row, decoded from the index. Premiums are rounded to cents."""
+    age_bracket: int
+    zip_prefix: str
+    provider_name: str
+    provider_code: str
+    monthly_premium: float
+    annual_premium: float
+    deductible: int
+    insurance_model: str
+    accident_coverage: bool
+    json: bytes  # the row as an encoded QuoteResponse
+
+
+def quote_json(provider_name: str, provider_code: str, monthly_premium: float, annual_premium: float,
+               deductible: int, insurance_model: str, accident_coverage: bool) -> bytes:
+    """Encode one quote with QuoteResponse's fields, in its field order."""
+    return dumps({
+        "provider_name": provider_name,
+        "provider_code": provider_code,
+        "monthly_premium": monthly_premium,
+        "annual_premium": annual_premium,
+        "deductible": deductible,
+        "insurance_model": insurance_model,
+        "accident_coverage": accident_coverage,
+    })
+
+
+def _encode_quote_json(columns: Dict[str, np.ndarray], dictionaries: dict, monthly: np.ndarray,
+                       annual: np.ndarray) -> Tuple[Iterator[np.ndarray], np.ndarray]:
+    """
+    Encode every row as QuoteResponse JSON, SNAPSHOT_BATCH_ROWS at a time,
+    into a temporary file, so only one batch of encoded rows is in memory.
+    Returns the encoded rows as chunks read back from that file, and their
+    offsets (row i is encoded[offsets[i]:offsets[i + 1]]).
+    """
+    providers = dictionaries["provider"]
+    deductibles = dictionaries["deductible"]
+    models = dictionaries["insurance_model"]
+    offsets = np.zeros(len(monthly) + 1, dtype=np.uint64)
+    spool = tempfile.TemporaryFile()
+    for start in range(0, len(monthly), SNAPSHOT_BATCH_ROWS):
+        batch = slice(start, start + SNAPSHOT_BATCH_ROWS)
+        fragments = [
+            quote_json(*providers[provider], monthly_premium, annual_premium,
+                       deductibles[deductible], models[model], accident_coverage)
+            for provider, monthly_premium, annual_premium, deductible, model, accident_coverage in zip(
+                columns["provider"][batch].tolist(), monthly[batch].tolist(), annual[batch].tolist(),
+                columns["deductible"][batch].tolist(), columns["insurance_model"][batch].tolist(),
+                columns["accident_coverage"][batch].tolist(),
+            )
+        ]
+        ends = offsets[start + 1:start + 1 + len(fragments)]
+        np.cumsum(np.fromiter(map(len, fragments), dtype=np.uint64, count=len(fragments)), out=ends)
+        ends += offsets[start]
+        spool.write(b"".join(fragments))
+    spool.seek(0)
+    return _read_chunks(spool), smallest_uint(offsets)
+
+
+def _read_chunks(f) -> Iterator[np.ndarray]:
+    """A file's bytes as uint8 chunks; closes (and so deletes) the file when done."""
+    with f:
+        while True:
+            block = f.read(1 << 20)
+            if not block:
+                return
+            yield np.frombuffer(block, dtype=np.uint8)
+
+
+# Filter combinations compare can be asked for; each gets its own sorted view
+COMPARE_VIEWS = ((), ("insurance_model",), ("deductible",), ("insurance_model", "deductible"))
+
+
+def _compare_view(keys: List[np.ndarray], premiums: np.ndarray) -> Tuple[np.ndarray, List[np.ndarray]]:
+    """
+    Sort entries by keys (most significant first), then premium. Returns
+    the order, and per group of equal keys each key's value followed by
+    the group's first position.
+    """
+    # lexsort is stable, so equal premiums keep insertion order
+    order = np.lexsort((premiums, *reversed(keys)))
+    keys = [key[order] for key in keys]
+    changed = np.zeros(max(len(order) - 1, 0), dtype=np.bool_)
+    for key in keys:
+        changed |= key[1:] != key[:-1]
+    firsts = np.flatnonzero(np.concatenate(([len(order) > 0], changed)))
+    return order, [key[firsts] for key in keys] + [firsts]
+
+
+def index_arrays(dataset, header: dict, columns: Dict[str, Column]) -> None:
+    """
+    Add the index's derived arrays to a snapshot's header and columns:
+
+        age_bracket         int16   ordinal of the age segment each row's bracket starts at
+        quote_json          uint8   every row encoded as a QuoteResponse, back to back
+        quote_json_offsets  uint    row i is quote_json[offsets[i]:offsets[i + 1]]
+        compare_order       uint    row ids by (zip, accident, segment, monthly premium, id),
+                                    once per COMPARE_VIEWS entry (the filtered views also by
+                                    model and/or deductible); a row whose bracket spans
+                                    several segments is in each
+        group_*             one entry per (zip, accident, segment[, model][, deductible])
+                            group of every view, model/deductible -1 where the view does
+                            not filter on it; group g is
+                            compare_order[group_start[g]:group_start[g + 1]]
+
+    Rounding and encoding happen once, here, instead of in every worker.
+    quote_json is a chunked column, encoded batch by batch through a
+    temporary file, so memory stays at the size of the typed arrays however
+    many rows the dataset has.
+    """
+    rows = header["rows"]
+
+    # Datasets loaded before brackets were materialized get them derived here
+    bounds, inverse = np.unique(np.stack([columns["age_min"], columns["age_max"]], axis=1),
+                                axis=0, return_inverse=True)
+    bounds = [tuple(b) for b in bounds.tolist()]
+    if dataset.age_brackets:
+        ages = AgeIntervalIndex(tuple(b) for b in dataset.age_brackets)
+    else:
+        ages = segment_brackets(bounds)
+    inverse = inverse.reshape(-1)
+    age_bracket = np.array([ages.find(lo) for lo, _ in bounds], dtype=np.int16)[inverse]
+    spans = np.array([ages.find(hi) - ages.find(lo) + 1 for lo, hi in bounds], dtype=np.int64)[inverse]
+    del inverse
+
+    # One entry per (row, segment it covers): row ids and segment ordinals
+    entries = int(spans.sum())
+    entry_rows = np.repeat(np.arange(rows, dtype=np.min_scalar_type(rows)), spans)
+    entry_segments = np.repeat(age_bracket, spans)
+    if entries > rows:
+        # Segments after the first: count up within each row's run
+        entry_segments += (np.arange(entries) - np.repeat(np.cumsum(spans) - spans, spans)).astype(np.int16)
+    del spans
+
+    # Python's round(), batch by batch: the same rule PriceRow applies, and
+    # unlike np.round it rounds half-cents by their exact decimal value
+    monthly = np.empty(rows, dtype=np.float64)
+    annual = np.empty(rows, dtype=np.float64)
+    for start in range(0, rows, SNAPSHOT_BATCH_ROWS):
+        batch = slice(start, start + SNAPSHOT_BATCH_ROWS)
+        monthly[batch] = [round(premium, 2) for premium in columns["monthly_premium"][batch].tolist()]
+        annual[batch] = [round(premium, 2) for premium in columns["annual_premium"][batch].tolist()]
+
+    encoded, offsets = _encode_quote_json(columns, header["dictionaries"], monthly, annual)
+
+    # One sorted view per filter combination, back to back in compare_order
+    keys = [columns["zip_prefix"][entry_rows], columns["accident_coverage"][entry_rows], entry_segments]
+    filters = {name: columns[name][entry_rows] for name in ("insurance_model", "deductible")}
+    premiums = monthly[entry_rows]
+    parts = {name: [] for name in ("compare_order", "group_zip", "group_accident", "group_bracket",
+                                   "group_model", "group_deductible", "group_start")}
+    for view, view_filters in enumerate(COMPARE_VIEWS):
+        order, groups = _compare_view(keys + [filters[name] for name in view_filters], premiums)
+        firsts = groups.pop()
+        parts["compare_order"].append(entry_rows[order])
+        for name, values in zip(("group_zip", "group_accident", "group_bracket"), groups):
+            parts[name].append(values)
+        for name, column in (("group_model", "insurance_model"), ("group_deductible", "deductible")):
+            if column in view_filters:
+                parts[name].append(groups[3 + view_filters.index(column)].astype(np.int32))
+            else:
+                parts[name].append(np.full(len(firsts), -1, dtype=np.int32))
+        parts["group_start"].append(firsts + view * entries)
+    compare_order, group_zip, group_accident, group_bracket, group_model, group_deductible, group_start = (
+        np.concatenate(parts[name]) for name in parts
+    )
+
+    header["age_brackets"] = [list(b) for b in ages.brackets]
+    header["age_lookup"] = dataset.age_lookup or dense_lookup(ages)
+    columns.update({
+        "age_bracket": age_bracket,
+        "quote_json": encoded,
+        "quote_json_offsets": offsets,
+        # Wide enough for rows + 1, so id + 1 never wraps
+        "compare_order": compare_order,
+        "group_zip": group_zip,
+        "group_accident": group_accident,
+        "group_bracket": group_bracket,
+        "group_model": group_model,
+        "group_deductible": group_deductible,
+        "group_start": smallest_uint(np.append(group_start, len(compare_order))),
+    })
+
+
+def indexed_snapshot(db: Session, dataset) -> Tuple[dict, Dict[str, Column]]:
+    """Header and columns of a dataset's snapshot, index arrays included."""
+    header, columns = dataset_columns(db, dataset)
+    index_arrays(dataset, header, columns)
+    return header, columns
+
+
+def write_dataset_snapshot(db: Session, dataset, directory: Path = SNAPSHOT_DIR) -> int:
+    """Write a dataset's snapshot for API workers to map. Returns bytes written."""
+    return write_snapshot(snapshot_path(dataset.id, directory), *indexed_snapshot(db, dataset))
+
+
+class Rows:
+    """
+    Matching rows of a QuoteIndex, as row ids into its arrays.
+    Behaves as a read-only sequence of PriceRow; json() gives the encoded
+    rows straight from the snapshot without decoding them.
+    """
+    __slots__ = ("index", "ids")
+
+    def __init__(self, index: "QuoteIndex", ids: np.ndarray):
+        self.index = index
+        self.ids = ids
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return Rows(self.index, self.ids[item])
+        return self.index.row(int(self.ids[item]))
+
+    def __iter__(self):
+        return map(self.index.row, self.ids.tolist())
+
+    def json(self) -> List[memoryview]:
+        """Each row as an encoded QuoteResponse (zero-copy views)."""
+        return self.index.json(self.ids)
+
+
+class QuoteIndex:
+    """
+    Read-only lookups for a single dataset over a snapshot's arrays.
+    Per process there is only a dict turning (zip_prefix, accident_coverage,
+    age_bracket) plus an optional model and deductible into a slice of
+    compare_order - every compare and quote is one lookup and a slice.
+    """
+
+    def __init__(self, dataset_id: int, snapshot: Snapshot, generation: int = 0):
+        header, columns = snapshot.header, snapshot.columns
+        self.dataset_id = dataset_id
+        # Dataset generation this index was built for (DatasetVersion.generation)
+        self.generation = generation
+        self.row_count = snapshot.row_count
+        self.mapped_bytes = snapshot.mapped_bytes
+        # age - MIN_AGE -> bracket ordinal (-1 = no bracket)
+        self.age_lookup = header["age_lookup"]
+
+        dictionaries = snapshot.dictionaries
+        self._zip_prefixes = dictionaries["zip_prefix"]
+        self._models = dictionaries["insurance_model"]
+        self._deductibles = dictionaries["deductible"]
+        self._providers = dictionaries["provider"]
+
+        self._columns = columns
+        self._order = columns["compare_order"]
+        self._json = memoryview(columns["quote_json"])
+        self._json_offsets = columns["quote_json_offsets"]
+
+        # (zip_prefix, accident_coverage, age_bracket, insurance_model, deductible) ->
+        # slice of compare_order; None model/deductible is the unfiltered view
+        starts = columns["group_start"].tolist()
+        self._groups: Dict[tuple, Tuple[int, int]] = {
+            (self._zip_prefixes[zip_prefix], accident_coverage, age_bracket,
+             self._models[model] if model >= 0 else None,
+             self._deductibles[deductible] if deductible >= 0 else None): (starts[g], starts[g + 1])
+            for g, (zip_prefix, accident_coverage, age_bracket, model, deductible) in enumerate(zip(
+                columns["group_zip"].tolist(),
+                columns["group_accident"].tolist(),
+                columns["group_bracket"].tolist(),
+                columns["group_model"].tolist(),
+                columns["group_deductible"].tolist(),
+            ))
+        }
+
+    def age_bracket(self, age: int) -> Optional[int]:
+        if not MIN_AGE <= age <= MAX_AGE:
+            return None
+        ordinal = self.age_lookup[age - MIN_AGE]
+        return ordinal if ordinal >= 0 else None
+
+    def _matches(self, zip_prefix: str, accident_coverage: bool, age: int,
+                 insurance_model: Optional[str], deductible: Optional[int]) -> np.ndarray:
+        """Row ids of a group's precomputed view, cheapest first."""
+        span = self._groups.get((zip_prefix, accident_coverage, self.age_bracket(age),
+                                 insurance_model, deductible))
+        if span is None:
+            return self._order[:0]
+        return self._order[span[0]:span[1]]
+
+    def quote(self, zip_prefix: str, insurance_model: str, deductible: int,
+              accident_coverage: bool, age: int) -> Rows:
+        """Rows of one exact configuration, in insertion order."""
+        return Rows(self, np.sort(self._matches(zip_prefix, accident_coverage, age,
+                                                insurance_model, deductible)))
+
+    def compare(self, zip_prefix: str, accident_coverage: bool, age: int,
+                insurance_model: Optional[str] = None,
+                deductible: Optional[int] = None) -> Rows:
+        """
+        Matching rows sorted by monthly premium (cheapest first).
+        Empty model / zero deductible mean "any", like None.
+        """
+        return Rows(self, self._matches(zip_prefix, accident_coverage, age,
+                                        insurance_model or None, deductible or None))
+
+    def json(self, ids: np.ndarray) -> List[memoryview]:
+        starts = self._json_offsets[ids].tolist()
+        ends = self._json_offsets[ids + 1].tolist()
+        encoded = self._json
+        return [encoded[start:end] for start, end in zip(starts, ends)]
+
+    def row(self, i: int) -> PriceRow:
+        columns = self._columns
+        provider_name, provider_code = self._providers[columns["provider"][i]]
+        start, end = self._json_offsets[i:i + 2].tolist()
+        return PriceRow(
+            int(columns["age_bracket"][i]),
+            self._zip_prefixes[columns["zip_prefix"][i]],
+            provider_name,
+            provider_code,
+            round(float(columns["monthly_premium"][i]), 2),
+            round(float(columns["annual_premium"][i]), 2),
+            self._deductibles[columns["deductible"][i]],
+            self._models[columns["insurance_model"][i]],
+            bool(columns["accident_coverage"][i]),
+            bytes(self._json[start:end]),
+        )
+
+
+class QuoteEngine:
+    """
+    Holds the index for the active dataset; reloads swap it atomically.
+    Subscribed to the active-dataset cache, so it moves to a new dataset
+    when the generation counter does. Requests already holding the old
+    index finish on it; its file is unmapped once the last one is done.
+    """
+
+    def __init__(self, snapshot_dir: Path = SNAPSHOT_DIR):
+        self.index: Optional[QuoteIndex] = None
+        self.snapshot_dir = snapshot_dir
+        self._lock = Lock()
+
+    def load(self, db: Session, dataset: Optional[ActiveDataset]) -> Optional[QuoteIndex]:
+        """(Re)build the index for the given active dataset."""
+        with self._lock:
+            if not dataset:
+                self.index = None
+                return None
+
+            self.index = QuoteIndex(dataset.id, self._snapshot(db, dataset), dataset.generation)
+            return self.index
+
+    def _snapshot(self, db: Session, dataset: ActiveDataset) -> Snapshot:
+        """
+        Map the dataset's snapshot. The loader normally wrote it before
+        activating the dataset; when it is missing or stale the first worker
+        to get here rebuilds it from the database while the others wait on
+        the lock, then they all map the same file.
+        """
+        try:
+            with snapshot_lock(dataset.id, self.snapshot_dir):
+                try:
+                    return open_dataset_snapshot(dataset, self.snapshot_dir)
+                except FileNotFoundError:
+                    pass
+                except SnapshotError as e:
+                    logger.warning("Rebuilding snapshot of dataset %s: %s", dataset.id, e)
+                write_dataset_snapshot(db, dataset, self.snapshot_dir)
+                return open_dataset_snapshot(dataset, self.snapshot_dir)
+        except OSError as e:
+            # e.g. a read-only SNAPSHOT_DIR: this worker keeps a private copy
+            logger.warning("Indexing dataset %s in memory, snapshot unavailable: %s", dataset.id, e)
+            header, columns = indexed_snapshot(db, dataset)
+            return Snapshot(header, collect_columns(columns))
+
+    def stats(self) -> Optional[dict]:
+        index = self.index
+        if index is None:
+            return None
+        return {
+            "dataset_id": index.dataset_id,
+            "generation": index.generation,
+            "rows": index.row_count,
+            "mapped_bytes": index.mapped_bytes,
+        }
+
+
+quote_engine = QuoteEngine()
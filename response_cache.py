@@ -0,0 +1,89 @@
+"""
+Response cache for quote/compare.
+Traffic is heavily skewed towards a few hundred configurations, so
+serialized response bodies are kept in an LRU keyed on the normalized
+request: ZIP reduced to its prefix and age mapped to its bracket ordinal,
+which is all the lookup depends on. Entries expire after a TTL and the
+whole cache is dropped whenever the active dataset changes.
+"""
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Hashable, Optional
+
+from sqlalchemy.orm import Session
+
+from active_dataset import ActiveDataset
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "10000"))  # entries; 0 disables
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))  # seconds
+
+
+class ResponseCache:
+    """LRU of serialized bodies with a per-entry TTL."""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_SIZE, ttl_seconds: float = RESPONSE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (expires_at, body)
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0  # dropped for size
+        self.expirations = 0  # dropped for age
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, body: bytes) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def on_dataset_change(self, db: Session, dataset: Optional[ActiveDataset]) -> None:
+        """ActiveDatasetCache listener - cached bodies belong to the old dataset."""
+        self.clear()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hit_ratio, 4),
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,179 @@
+"""
+Dataset retention and compaction.
+
+Keeps the newest RETAIN_DATASETS datasets (the active one always stays)
+and removes the rest: a DROP TABLE for datasets with their own price
+table, bounded DELETE batches - each its own short transaction, so
+readers are never blocked for long - for rows in the shared table.
+Afterwards the database is compacted (VACUUM + ANALYZE) and the bytes
+reclaimed are reported.
+
+Run with `python loader.py --retain [N]`, or in the API by setting
+RETENTION_INTERVAL_SECONDS.
+"""
+import logging
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Thread
+from typing import Iterator, List, NamedTuple, Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from models import DatasetVersion, PricingDataset
+from snapshot import SNAPSHOT_DIR, remove_snapshot
+from storage import drop_dataset_rows, prices_table
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, every worker runs retention
+    fcntl = None
+
+RETAIN_DATASETS = int(os.getenv("RETAIN_DATASETS", "3"))
+RETENTION_BATCH_ROWS = int(os.getenv("RETENTION_BATCH_ROWS", "50000"))
+# 0 = no background retention in the API
+RETENTION_INTERVAL_SECONDS = float(os.getenv("RETENTION_INTERVAL_SECONDS", "0"))
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionReport(NamedTuple):
+    removed_datasets: List[int]
+    removed_rows: int
+    bytes_before: int
+    bytes_after: int
+
+    @property
+    def bytes_reclaimed(self) -> int:
+        return max(self.bytes_before - self.bytes_after, 0)
+
+
+def expired_datasets(db: Session, keep: int) -> List[PricingDataset]:
+    """Datasets beyond the newest `keep`, never including the active one."""
+    active_id = db.query(DatasetVersion.active_dataset_id).filter(DatasetVersion.id == 1).scalar()
+    datasets = db.query(PricingDataset).order_by(PricingDataset.id.desc()).all()
+    return [
+        dataset for dataset in datasets[keep:]
+        if dataset.id != active_id and not dataset.is_active
+    ]
+
+
+def remove_dataset(db: Session, dataset: PricingDataset, batch_rows: int = RETENTION_BATCH_ROWS) -> int:
+    """Delete a dataset, its price rows and snapshot, committing as it goes. Returns rows removed."""
+    remove_snapshot(dataset.id)
+    if dataset.storage_table is not None:
+        removed = dataset.row_count or 0
+        drop_dataset_rows(db, dataset.id, dataset.storage_table)
+    else:
+        table = prices_table(None)
+        removed = 0
+        while True:
+            batch = select(table.c.id).where(table.c.dataset_id == dataset.id).limit(batch_rows)
+            deleted = db.execute(delete(table).where(table.c.id.in_(batch.scalar_subquery()))).rowcount
+            db.commit()
+            removed += deleted
+            if deleted < batch_rows:
+                break
+
+    db.query(PricingDataset).filter(
+        PricingDataset.id == dataset.id
+    ).delete(synchronize_session=False)
+    db.commit()
+    return removed
+
+
+def database_bytes(engine: Engine) -> int:
+    with engine.connect() as conn:
+        if engine.dialect.name == "sqlite":
+            page_count = conn.exec_driver_sql("PRAGMA page_count").scalar()
+            page_size = conn.exec_driver_sql("PRAGMA page_size").scalar()
+            return page_count * page_size
+        if engine.dialect.name == "postgresql":
+            return conn.exec_driver_sql("SELECT pg_database_size(current_database())").scalar()
+    return 0
+
+
+def compact(engine: Engine) -> None:
+    """Return freed pages to the OS and refresh planner statistics."""
+    # VACUUM cannot run inside a transaction
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if engine.dialect.name == "sqlite":
+            conn.exec_driver_sql("VACUUM")
+            conn.exec_driver_sql("ANALYZE")
+        elif engine.dialect.name == "postgresql":
+            conn.exec_driver_sql("VACUUM (ANALYZE)")
+
+
+def run_retention(db: Session, engine: Engine, keep: int = RETAIN_DATASETS,
+                  batch_rows: int = RETENTION_BATCH_ROWS) -> RetentionReport:
+    """Remove expired datasets; compact only when something was removed."""
+    if keep < 1:
+        raise ValueError("keep must be at least 1")
+
+    bytes_before = database_bytes(engine)
+    removed_datasets, removed_rows = [], 0
+    for dataset in expired_datasets(db, keep):
+        removed_datasets.append(dataset.id)
+        removed_rows += remove_dataset(db, dataset, batch_rows)
+
+    if removed_datasets:
+        compact(engine)
+    return RetentionReport(removed_datasets, removed_rows, bytes_before, database_bytes(engine))
+
+
+@contextmanager
+def retention_lock(directory: Path = SNAPSHOT_DIR) -> Iterator[bool]:
+    """
+    Non-blocking cross-process lock for one retention run. Yields False
+    when another process holds it.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / "retention.lock", "wb") as f:
+        if fcntl is not None:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+        yield True
+
+
+def start_background_retention(session_factory, engine: Engine,
+                               interval_seconds: float = RETENTION_INTERVAL_SECONDS,
+                               keep: int = RETAIN_DATASETS,
+                               lock_dir: Path = SNAPSHOT_DIR) -> Optional[Thread]:
+    """
+    Run retention every interval_seconds in a daemon thread (no-op when the
+    interval is 0). Every uvicorn worker starts one; retention_lock lets
+    only one of them run at a time and the others skip that interval.
+    """
+    if interval_seconds <= 0:
+        return None
+
+    def loop():
+        while True:
+            time.sleep(interval_seconds)
+            db = session_factory()
+            try:
+                with retention_lock(lock_dir) as acquired:
+                    if not acquired:
+                        logger.debug("Dataset retention already running in another process")
+                        continue
+                    report = run_retention(db, engine, keep)
+                if report.removed_datasets:
+                    logger.info(
+                        "Retention removed datasets %s (%d rows), reclaimed %d bytes",
+                        report.removed_datasets, report.removed_rows, report.bytes_reclaimed,
+                    )
+            except Exception:
+                logger.exception("Dataset retention failed")
+            finally:
+                db.close()
+
+    thread = Thread(target=loop, name="dataset-retention", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,292 @@
+"""
+Columnar binary snapshots of price datasets.
+
+A snapshot holds one typed array per column, in row-id order, with
+strings dictionary-encoded:
+
+    age_min, age_max   uint     bracket bounds
+    zip_prefix         uint     code into dictionaries.zip_prefix
+    insurance_model    uint     code into dictionaries.insurance_model
+    deductible         uint     code into dictionaries.deductible
+    accident_coverage  bool
+    monthly_premium    float64
+    annual_premium     float64
+    provider           uint     code into dictionaries.provider ([name, code] pairs)
+
+plus whatever derived arrays the writer adds (the quote index's, see
+quote_engine.py). Layout: MAGIC, the arrays (each 64-byte aligned), a
+JSON header with the dataset identity, dictionaries and array offsets,
+then the header length as a little-endian uint64 and MAGIC again.
+
+Opening a snapshot maps the file read-only and wraps the arrays in
+place - no parsing, no copies. Every worker process that maps the same
+file shares its pages through the OS page cache, so a dataset is held in
+memory once per machine rather than once per worker.
+"""
+import json
+import mmap
+import os
+import struct
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, NamedTuple, Tuple, Union
+
+import numpy as np
+from sqlalchemy import Select, Table, func, select
+from sqlalchemy.orm import Session
+
+from storage import dataset_filter, prices_table
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, concurrent builds just race
+    fcntl = None
+
+SNAPSHOT_DIR = Path(os.getenv("SNAPSHOT_DIR", "snapshots"))
+SNAPSHOT_BATCH_ROWS = 10_000
+
+MAGIC = b"LMXSNAP1"
+FORMAT_VERSION = 3
+ALIGNMENT = 64
+_TRAILER = struct.Struct("<Q8s")
+
+# Columns read from the price table, in the order they are selected
+SOURCE_COLUMNS = (
+    'age_min',
+    'age_max',
+    'zip_prefix',
+    'insurance_model',
+    'deductible',
+    'accident_coverage',
+    'monthly_premium',
+    'annual_premium',
+    'provider_name',
+    'provider_code',
+)
+DICTIONARY_COLUMNS = ('zip_prefix', 'insurance_model', 'deductible', 'provider')
+
+# A column to write: a whole array, or an iterable of same-dtype chunks that
+# is only consumed while the file is written (so it can be produced lazily)
+Column = Union[np.ndarray, Iterable[np.ndarray]]
+
+
+def snapshot_query(dataset_id: int, table: Table) -> Select:
+    """All rows of a dataset in insertion order, as SOURCE_COLUMNS tuples."""
+    return (
+        select(*(table.c[name] for name in SOURCE_COLUMNS))
+        .where(*dataset_filter(table, dataset_id))
+        .order_by(table.c.id)
+    )
+
+
+class SnapshotError(ValueError):
+    """A snapshot file is malformed or belongs to a different dataset."""
+
+
+class Snapshot(NamedTuple):
+    header: dict
+    columns: Dict[str, np.ndarray]  # read-only views into the mapped file
+    mapped_bytes: int = 0  # size of the mapped file; 0 when the arrays are private memory
+
+    @property
+    def dictionaries(self) -> Dict[str, list]:
+        return self.header["dictionaries"]
+
+    @property
+    def row_count(self) -> int:
+        return self.header["rows"]
+
+
+def snapshot_path(dataset_id: int, directory: Path = SNAPSHOT_DIR) -> Path:
+    return Path(directory) / f"dataset-{dataset_id}.snap"
+
+
+def dataset_identity(dataset) -> dict:
+    """Fields a snapshot must match to stand in for a dataset's rows."""
+    return {
+        "dataset_id": dataset.id,
+        "uploaded_at": dataset.uploaded_at.isoformat() if dataset.uploaded_at else None,
+    }
+
+
+class _Dictionary:
+    """Incremental dictionary encoder; codes follow first appearance."""
+
+    def __init__(self):
+        self.codes: dict = {}
+
+    def encode(self, values: np.ndarray) -> np.ndarray:
+        # Only the distinct values of a batch go through Python
+        uniques, inverse = np.unique(values, return_inverse=True)
+        codes = np.array([self.codes.setdefault(v, len(self.codes)) for v in uniques.tolist()],
+                         dtype=np.int64)
+        return codes[inverse]
+
+    @property
+    def values(self) -> list:
+        return list(self.codes)
+
+
+def smallest_uint(values: np.ndarray) -> np.ndarray:
+    """values in the narrowest unsigned dtype that holds them."""
+    return values.astype(np.min_scalar_type(int(values.max()) if len(values) else 0))
+
+
+def _align(offset: int) -> int:
+    return -offset % ALIGNMENT
+
+
+def collect_columns(columns: Dict[str, Column]) -> Dict[str, np.ndarray]:
+    """Chunked columns joined into whole arrays, for a snapshot kept in memory."""
+    arrays = {}
+    for name, column in columns.items():
+        chunks = [column] if isinstance(column, np.ndarray) else list(column)
+        # No chunks at all: an empty array, as write_snapshot writes it
+        arrays[name] = np.concatenate(chunks) if chunks else np.empty(0, np.uint8)
+    return arrays
+
+
+def write_snapshot(path: Path, header: dict, columns: Dict[str, Column]) -> int:
+    """
+    Write columns and header to path atomically (temp file + rename, so a
+    reader never sees a partial file). Chunked columns are written chunk by
+    chunk, in column order. Returns the file size in bytes.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+
+    arrays = {}
+    try:
+        with open(tmp, "wb") as f:
+            f.write(MAGIC)
+            for name, column in columns.items():
+                f.write(b"\0" * _align(f.tell()))
+                meta = arrays[name] = {"dtype": None, "length": 0, "offset": f.tell()}
+                for chunk in [column] if isinstance(column, np.ndarray) else column:
+                    chunk = np.ascontiguousarray(chunk)
+                    if meta["dtype"] is None:
+                        meta["dtype"] = chunk.dtype.str
+                    elif chunk.dtype.str != meta["dtype"]:
+                        raise ValueError(f"column {name} mixes {meta['dtype']} and {chunk.dtype.str} chunks")
+                    meta["length"] += len(chunk)
+                    f.write(chunk.data)
+                if meta["dtype"] is None:  # no chunks at all
+                    meta["dtype"] = np.dtype(np.uint8).str
+            encoded = json.dumps({**header, "version": FORMAT_VERSION, "arrays": arrays}).encode()
+            f.write(encoded)
+            f.write(_TRAILER.pack(len(encoded), MAGIC))
+            size = f.tell()
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return size
+
+
+def open_snapshot(path: Path) -> Snapshot:
+    """Map a snapshot file read-only and wrap its arrays without copying."""
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(buffer) < len(MAGIC) + _TRAILER.size or buffer[:len(MAGIC)] != MAGIC:
+        raise SnapshotError(f"{path} is not a price snapshot")
+    header_size, magic = _TRAILER.unpack_from(buffer, len(buffer) - _TRAILER.size)
+    header_end = len(buffer) - _TRAILER.size
+    if magic != MAGIC or header_size > header_end:
+        raise SnapshotError(f"{path} is truncated")
+    header = json.loads(buffer[header_end - header_size:header_end])
+    if header.get("version") != FORMAT_VERSION:
+        raise SnapshotError(f"{path} has unsupported version {header.get('version')}")
+
+    columns = {}
+    for name, meta in header["arrays"].items():
+        dtype = np.dtype(meta["dtype"])
+        if meta["offset"] + meta["length"] * dtype.itemsize > header_end - header_size:
+            raise SnapshotError(f"{path}: array {name} runs past the data section")
+        # The arrays keep the map alive; it is unmapped once they are all gone
+        columns[name] = np.frombuffer(buffer, dtype, meta["length"], meta["offset"])
+    return Snapshot(header, columns, len(buffer))
+
+
+def open_dataset_snapshot(dataset, directory: Path = SNAPSHOT_DIR) -> Snapshot:
+    """
+    Map a dataset's snapshot. FileNotFoundError when it has none,
+    SnapshotError when the file does not match the dataset.
+    """
+    snapshot = open_snapshot(snapshot_path(dataset.id, directory))
+    identity = dataset_identity(dataset)
+    if any(snapshot.header.get(key) != value for key, value in identity.items()):
+        raise SnapshotError(f"snapshot for dataset {dataset.id} is stale")
+    return snapshot
+
+
+@contextmanager
+def snapshot_lock(dataset_id: int, directory: Path = SNAPSHOT_DIR) -> Iterator[None]:
+    """Exclusive cross-process lock for building one dataset's snapshot."""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / f"dataset-{dataset_id}.lock", "wb") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def dataset_columns(db: Session, dataset) -> Tuple[dict, Dict[str, np.ndarray]]:
+    """
+    Header and source columns of a dataset, read from its price table.
+    Rows are streamed in batches into preallocated arrays, so memory stays
+    at the size of the arrays.
+    """
+    table = prices_table(dataset.storage_table)
+    rows = db.execute(
+        select(func.count()).select_from(table).where(*dataset_filter(table, dataset.id))
+    ).scalar()
+    age_min = np.empty(rows, dtype=np.int64)
+    age_max = np.empty(rows, dtype=np.int64)
+    accident = np.empty(rows, dtype=np.bool_)
+    monthly = np.empty(rows, dtype=np.float64)
+    annual = np.empty(rows, dtype=np.float64)
+    codes = {name: np.empty(rows, dtype=np.int64) for name in DICTIONARY_COLUMNS}
+    dictionaries = {name: _Dictionary() for name in DICTIONARY_COLUMNS}
+
+    result = db.execute(
+        snapshot_query(dataset.id, table).execution_options(yield_per=SNAPSHOT_BATCH_ROWS)
+    )
+    filled = 0
+    for batch in result.partitions():
+        end = filled + len(batch)
+        if end > rows:
+            raise SnapshotError(f"dataset {dataset.id} grew while its snapshot was read")
+        (mins, maxes, zips, models, deductibles, accidents,
+         monthlies, annuals, names, provider_codes) = (np.asarray(c, dtype=object) for c in zip(*batch))
+        age_min[filled:end] = mins.astype(np.int64)
+        age_max[filled:end] = maxes.astype(np.int64)
+        accident[filled:end] = accidents.astype(np.bool_)
+        monthly[filled:end] = monthlies.astype(np.float64)
+        annual[filled:end] = annuals.astype(np.float64)
+        codes["zip_prefix"][filled:end] = dictionaries["zip_prefix"].encode(zips)
+        codes["insurance_model"][filled:end] = dictionaries["insurance_model"].encode(models)
+        codes["deductible"][filled:end] = dictionaries["deductible"].encode(deductibles.astype(np.int64))
+        # Unit separator: cannot occur in names or codes from a price sheet
+        codes["provider"][filled:end] = dictionaries["provider"].encode(names + "\x1f" + provider_codes)
+        filled = end
+    if filled != rows:
+        raise SnapshotError(f"dataset {dataset.id} shrank while its snapshot was read")
+
+    values = {name: dictionaries[name].values for name in DICTIONARY_COLUMNS}
+    values["provider"] = [key.split("\x1f", 1) for key in values["provider"]]
+    columns = {
+        "age_min": smallest_uint(age_min),
+        "age_max": smallest_uint(age_max),
+        **{name: smallest_uint(codes[name]) for name in ("zip_prefix", "insurance_model", "deductible")},
+        "accident_coverage": accident,
+        "monthly_premium": monthly,
+        "annual_premium": annual,
+        "provider": smallest_uint(codes["provider"]),
+    }
+    header = {**dataset_identity(dataset), "rows": rows, "dictionaries": values}
+    return header, columns
+
+
+def remove_snapshot(dataset_id: int, directory: Path = SNAPSHOT_DIR) -> None:
+    snapshot_path(dataset_id, directory).unlink(missing_ok=True)
+    (Path(directory) / f"dataset-{dataset_id}.lock").unlink(missing_ok=True)
@@ -0,0 +1,86 @@
+"""
+Per-dataset physical storage for price rows.
+
+Every dataset the loader writes gets its own table, insurance_prices_<id>,
+with the insurance_prices columns and option index. Loading a new dataset
+never grows the tables or indexes of the one being served, reads only
+ever touch the active dataset's table, and retiring a dataset is a DROP
+TABLE instead of a DELETE over millions of rows.
+
+Datasets with no storage_table (written before this existed) stay in the
+shared insurance_prices table.
+"""
+from threading import Lock
+from typing import Dict, Optional
+
+from sqlalchemy import Column, Index, MetaData, Table
+from sqlalchemy.orm import Session
+
+from models import InsurancePrice, PricingDataset
+
+# Per-dataset tables live outside Base.metadata, so create_all never builds them
+partition_metadata = MetaData()
+
+# idx_prices_options (see models.InsurancePrice) minus dataset_id, constant per table
+OPTIONS_INDEX_COLUMNS = ('insurance_model', 'deductible', 'provider_name', 'provider_code')
+
+_tables: Dict[str, Table] = {}
+_lock = Lock()
+
+
+def partition_name(dataset_id: int) -> str:
+    return f"{InsurancePrice.__tablename__}_{dataset_id}"
+
+
+def options_index_name(storage_table: str) -> str:
+    return f"idx_{storage_table}_options"
+
+
+def prices_table(storage_table: Optional[str]) -> Table:
+    """Table holding a dataset's rows, given PricingDataset.storage_table."""
+    if storage_table is None:
+        return InsurancePrice.__table__
+
+    with _lock:
+        table = _tables.get(storage_table)
+        if table is None:
+            # Same columns, no foreign key: the table is dropped together with
+            # its dataset row, in either order
+            table = Table(storage_table, partition_metadata, *(
+                Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable,
+                       default=c.default.arg if c.default is not None else None)
+                for c in InsurancePrice.__table__.columns
+            ))
+            # A partition is read whole in rowid order, so only the covering
+            # options index carries over (index names are per schema)
+            Index(options_index_name(storage_table), *(table.c[name] for name in OPTIONS_INDEX_COLUMNS))
+            _tables[storage_table] = table
+        return table
+
+
+def dataset_filter(table: Table, dataset_id: int) -> tuple:
+    """WHERE clauses selecting a dataset's rows in its table - none for its own table."""
+    if table is InsurancePrice.__table__:
+        return (table.c.dataset_id == dataset_id,)
+    return ()
+
+
+def create_partition(db: Session, dataset: PricingDataset) -> Table:
+    """Create an empty table for a staged dataset and record it on the dataset."""
+    dataset.storage_table = partition_name(dataset.id)
+    table = prices_table(dataset.storage_table)
+    table.create(db.connection(), checkfirst=True)
+    return table
+
+
+def drop_dataset_rows(db: Session, dataset_id: int, storage_table: Optional[str]) -> None:
+    """Remove a dataset's price rows: DROP TABLE for a partition, DELETE for the shared table."""
+    table = prices_table(storage_table)
+    if storage_table is None:
+        db.execute(table.delete().where(table.c.dataset_id == dataset_id))
+        return
+
+    table.drop(db.connection(), checkfirst=True)
+    with _lock:
+        _tables.pop(storage_table, None)
+        partition_metadata.remove(table)